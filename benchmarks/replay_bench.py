@@ -0,0 +1,301 @@
+"""
+Воспроизведение обновлений через dp.feed_update с заглушкой сессии:
+CPU-время на обновление по обработчикам, выделения памяти (tracemalloc), вызовы API
+и пропускная способность при 1, 100 и 10 000 топиков у пользователя; сравнение с базовым уровнем
+
+Запуск: python -m benchmarks.replay_bench [--update-baseline] [--check-time] [--replay updates.jsonl]
+Код возврата 1, если результат хуже базового уровня больше допуска. По умолчанию сравниваются
+только детерминированные метрики (выделения памяти и вызовы API); время зависит от машины
+и проверяется с --check-time относительно калибровочной нагрузки в том же процессе
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from aiogram.types import Update
+
+from benchmarks import stubs
+from src import bot as app
+from src.diagnostics import HandlerNameMiddleware, trace_update
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+TOPIC_COUNTS = (1, 100, 10_000)
+
+# Сценарий -> построитель сырого обновления по номеру итерации и ID топиков
+SCENARIOS: Dict[str, Callable[[int, int, List[int]], Dict[str, Any]]] = {
+    'start': lambda user_id, i, ids: stubs.message_update(user_id, '/start'),
+    'list': lambda user_id, i, ids: stubs.message_update(user_id, '/list'),
+    'stats': lambda user_id, i, ids: stubs.message_update(user_id, '/stats'),
+    'topic_info': lambda user_id, i, ids: stubs.callback_update(user_id, f'topic_info_{ids[i % len(ids)]}'),
+    'pin': lambda user_id, i, ids: stubs.callback_update(user_id, f'pin_{ids[i % len(ids)]}'),
+    'unpin': lambda user_id, i, ids: stubs.callback_update(user_id, f'unpin_{ids[i % len(ids)]}'),
+    'topic_text': lambda user_id, i, ids: stubs.message_update(user_id, f'Сообщение {i}', ids[i % len(ids)]),
+}
+
+# Детерминированные метрики: проверяются всегда, допуск фиксированный и узкий
+# (вызовы API в базовом уровне округлены до сотых - допуск только на округление)
+DETERMINISTIC_TOLERANCES = {'alloc_kb': 0.10, 'api_calls': 0.01}
+# Время зависит от машины: допуск задается при запуске, для p95 - вдвое шире
+TIME_METRICS = {'cpu_p50_us': 1, 'cpu_p95_us': 2, 'updates_per_sec': 1}
+LOWER_IS_WORSE = {'updates_per_sec'}
+
+# Запись базового уровня с временем калибровочной нагрузки
+CALIBRATION_KEY = '_calibration'
+
+
+def iterations_for(scale: float) -> int:
+    """Не меньше 20 итераций: иначе p95 - это просто максимум"""
+    return max(20, int(100 * scale))
+
+
+def calibrate(rounds: int = 5) -> float:
+    """
+    CPU-время (мкс) фиксированной нагрузки, похожей на обработчики (JSON, словари, строки):
+    времена сравниваются с базовым уровнем с поправкой на скорость машины
+    """
+    topics = {
+        topic_id: {'name': f'Топик {topic_id}', 'is_closed': topic_id % 3 == 0, 'messages_count': topic_id}
+        for topic_id in range(2000)
+    }
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.process_time()
+        for _ in range(5):
+            decoded = json.loads(json.dumps(topics, ensure_ascii=False))
+            "\n".join(info['name'] for info in sorted(decoded.values(), key=lambda info: info['messages_count']))
+        best = min(best, time.process_time() - start)
+    return best * 1_000_000
+
+
+def build_updates(bot, raws: List[Dict[str, Any]]) -> List[Update]:
+    """Модели собираются заранее: в замер попадает только обработка"""
+    return [Update.model_validate(raw, context={'bot': bot}) for raw in raws]
+
+
+async def time_round(bot, updates: List[Update]) -> Tuple[List[float], float, Optional[str]]:
+    """Один проход: CPU-время каждого обновления (не зависит от соседних процессов), общее время и обработчик"""
+    latencies = []
+    handler = None
+    # Паузы сборщика мусора делают p95 случайным между запусками
+    gc.collect()
+    gc.disable()
+    try:
+        wall_start = time.perf_counter()
+        for update in updates:
+            with trace_update() as trace:
+                start = time.process_time()
+                await app.dp.feed_update(bot, update)
+                latencies.append(time.process_time() - start)
+            handler = trace.handler or handler
+        wall = time.perf_counter() - wall_start
+    finally:
+        gc.enable()
+    return latencies, wall, handler
+
+
+async def measure(bot, updates: List[Update], rounds: int = 3, alloc_samples: int = 10) -> Dict[str, Any]:
+    """
+    CPU-время и пропускная способность (лучший из нескольких проходов, как в timeit:
+    помехи от соседних процессов только замедляют), затем отдельный проход с tracemalloc
+    """
+    calls_before = sum(bot.session.requests.values())
+    latencies, wall, handler = min(
+        [await time_round(bot, updates) for _ in range(rounds)],
+        key=lambda result: statistics.median(result[0])
+    )
+    api_calls = (sum(bot.session.requests.values()) - calls_before) / (rounds * len(updates))
+
+    # tracemalloc сильно замедляет выполнение, поэтому не смешивается с замером времени
+    peaks = []
+    tracemalloc.start()
+    try:
+        for update in updates[:alloc_samples]:
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            await app.dp.feed_update(bot, update)
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    finally:
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'handler': handler or '-',
+        'updates': len(updates),
+        'cpu_p50_us': statistics.median(latencies) * 1_000_000,
+        'cpu_p95_us': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1_000_000,
+        'updates_per_sec': len(updates) / wall,
+        'alloc_kb': statistics.median(peaks) / 1024,
+        'api_calls': api_calls,
+    }
+
+
+async def run_scenarios(scale: float, only: List[str]) -> Dict[str, Dict[str, Any]]:
+    bot = stubs.make_bot()
+    random.seed(0)
+    results = {}
+    try:
+        for topics in TOPIC_COUNTS:
+            # Отдельный пользователь на каждый размер карты
+            user_id = 10_000 + topics
+            ids = stubs.seed_topics(app.get_user_topics(bot), user_id, topics)
+            random.shuffle(ids)
+            count = iterations_for(scale)
+
+            for name, build in SCENARIOS.items():
+                if only and name not in only:
+                    continue
+                # Прогрев: компиляция схем и кэши клавиатур
+                for update in build_updates(bot, [build(user_id, i, ids) for i in range(3)]):
+                    await app.dp.feed_update(bot, update)
+
+                updates = build_updates(bot, [build(user_id, i, ids) for i in range(count)])
+                results[f'{name}@{topics}'] = await measure(bot, updates)
+    finally:
+        stubs.release_bot(bot)
+    return results
+
+
+async def run_replay(path: str) -> Dict[str, Dict[str, Any]]:
+    """Записанные обновления (JSONL, по одному сырому обновлению в строке), сгруппированные по обработчику"""
+    bot = stubs.make_bot()
+    with open(path, encoding='utf-8') as f:
+        updates = build_updates(bot, [json.loads(line) for line in f if line.strip()])
+
+    groups: Dict[str, List[Update]] = {}
+    try:
+        # Первый проход определяет обработчик каждого обновления
+        for update in updates:
+            with trace_update() as trace:
+                await app.dp.feed_update(bot, update)
+            groups.setdefault(trace.handler or '-', []).append(update)
+
+        results = {}
+        for handler, group in groups.items():
+            results[f'replay:{handler}'] = await measure(bot, group)
+    finally:
+        stubs.release_bot(bot)
+    return results
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+            time_tolerance: Optional[float] = None, speed_ratio: float = 1.0) -> List[str]:
+    """
+    Список регрессий относительно базового уровня
+    time_tolerance - включает проверку времени; speed_ratio - во сколько раз текущая машина
+    медленнее базовой на калибровочной нагрузке
+    """
+    tolerances = dict(DETERMINISTIC_TOLERANCES)
+    if time_tolerance is not None:
+        tolerances.update({metric: time_tolerance * factor for metric, factor in TIME_METRICS.items()})
+
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        # При другом числе итераций перцентили несопоставимы
+        if base is None or base.get('updates') != result['updates']:
+            continue
+        for metric, tolerance in tolerances.items():
+            if not base.get(metric):
+                continue
+            expected = base[metric]
+            if metric in TIME_METRICS:
+                expected = expected / speed_ratio if metric in LOWER_IS_WORSE else expected * speed_ratio
+            change = result[metric] / expected - 1
+            if metric in LOWER_IS_WORSE:
+                change = -change
+            if change > tolerance:
+                regressions.append(
+                    f"{key} {metric}: {base[metric]:.1f} -> {result[metric]:.1f} "
+                    f"({change:+.0%}, допуск {tolerance:.0%})"
+                )
+    return regressions
+
+
+def print_results(results: Dict[str, Dict[str, Any]]):
+    print(
+        f"{'Сценарий':<22} {'Обработчик':<24} {'p50 CPU мкс':>12} {'p95 CPU мкс':>12} "
+        f"{'upd/s':>8} {'КБ/upd':>8} {'API/upd':>8}"
+    )
+    for key, r in results.items():
+        print(
+            f"{key:<22} {r['handler']:<24} {r['cpu_p50_us']:>12.0f} {r['cpu_p95_us']:>12.0f} "
+            f"{r['updates_per_sec']:>8.0f} {r['alloc_kb']:>8.1f} {r['api_calls']:>8.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--update-baseline', action='store_true', help="записать результаты как базовый уровень")
+    parser.add_argument('--replay', help="JSONL с записанными обновлениями вместо синтетических сценариев")
+    parser.add_argument('--scenario', action='append', default=[], choices=list(SCENARIOS))
+    parser.add_argument('--scale', type=float, default=1.0, help="множитель числа итераций")
+    parser.add_argument('--check-time', action='store_true',
+                        help="проверять CPU-время и пропускную способность (с поправкой на калибровку)")
+    parser.add_argument('--time-tolerance', type=float, default=0.30,
+                        help="допустимое ухудшение CPU-времени и пропускной способности (доля)")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    stubs.disable_throttling()
+    app.dp.message.middleware(HandlerNameMiddleware())
+    app.dp.callback_query.middleware(HandlerNameMiddleware())
+
+    if args.replay:
+        results = asyncio.run(run_replay(args.replay))
+    else:
+        results = asyncio.run(run_scenarios(args.scale, args.scenario))
+    calibration_us = calibrate()
+    print_results(results)
+    print(f"\nКалибровочная нагрузка: {calibration_us:.0f} мкс CPU")
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    if args.update_baseline:
+        baseline.update({
+            key: {
+                metric: round(value, 2 if metric == 'api_calls' else 1) if isinstance(value, float) else value
+                for metric, value in r.items()
+            }
+            for key, r in results.items()
+        })
+        baseline[CALIBRATION_KEY] = {'cpu_us': round(calibration_us, 1)}
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nБазовый уровень записан: {args.baseline}")
+        return
+
+    if not baseline:
+        print("\nБазовый уровень не найден, сравнение пропущено (--update-baseline)")
+        return
+
+    speed_ratio = 1.0
+    if args.check_time:
+        base_calibration = baseline.get(CALIBRATION_KEY, {}).get('cpu_us')
+        if base_calibration:
+            speed_ratio = calibration_us / base_calibration
+            print(f"Машина медленнее базовой в {speed_ratio:.2f} раза")
+    regressions = compare(results, baseline, args.time_tolerance if args.check_time else None, speed_ratio)
+    if regressions:
+        print("\n❌ Регрессии:\n" + "\n".join(f"   {line}" for line in regressions))
+        sys.exit(1)
+    print("\n✅ Регрессий нет")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Сравнение профилей выполнения (asyncio+json против uvloop+orjson)
+на существующих обработчиках: обновлений в секунду и CPU на обновление
+
+Запуск: python -m benchmarks.runtime_bench [--updates 5000]
+"""
+
+import argparse
+import logging
+import time
+
+from benchmarks import stubs
+from src import bot as app
+from src import runtime
+
+
+def build_workload(bot, updates: int, topics: int = 50) -> list:
+    """Смешанный поток обновлений, похожий на реальный трафик"""
+    user_id = 1001
+    topic_ids = stubs.seed_topics(app.get_user_topics(bot), user_id, topics)
+    dumps = bot.session.json_dumps
+
+    pattern = [
+        lambda i: stubs.message_update(user_id, '/start'),
+        lambda i: stubs.message_update(user_id, '/list'),
+        lambda i: stubs.message_update(user_id, '/stats'),
+        lambda i: stubs.message_update(user_id, f'Сообщение {i}', topic_ids[i % topics]),
+        lambda i: stubs.callback_update(user_id, f'topic_info_{topic_ids[i % topics]}'),
+        lambda i: stubs.callback_update(user_id, f'pin_{topic_ids[i % topics]}'),
+    ]
+    # Обновления хранятся сырыми JSON-строками, как приходят из getUpdates
+    return [dumps(pattern[i % len(pattern)](i)) for i in range(updates)]
+
+
+async def run_profile(fast: bool, updates: int) -> dict:
+    bot = stubs.make_bot(fast=fast)
+    stubs.disable_throttling()
+    workload = build_workload(bot, updates)
+    loads = bot.session.json_loads
+
+    # Прогрев: компиляция pydantic-схем и кэши клавиатур
+    for raw in workload[:50]:
+        await app.dp.feed_raw_update(bot, loads(raw))
+
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    for raw in workload:
+        await app.dp.feed_raw_update(bot, loads(raw))
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+    stubs.release_bot(bot)
+    return {
+        'profile': runtime.describe(fast),
+        'updates_per_sec': updates / wall,
+        'cpu_us_per_update': cpu / updates * 1_000_000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--updates', type=int, default=5000)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = [runtime.run(run_profile(fast, args.updates), fast=fast) for fast in (False, True)]
+
+    print(f"{'Профиль':<16} {'upd/s':>10} {'CPU мкс/upd':>12}")
+    for r in results:
+        print(f"{r['profile']:<16} {r['updates_per_sec']:>10.0f} {r['cpu_us_per_update']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Заглушки для бенчмарков: сессия бота без сети и синтетические обновления
+"""
+
+import asyncio
+import itertools
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+
+BENCH_TOKEN = "42:benchmark-token"
+BOT_USER = {'id': 42, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+
+
+class StubSession(BaseSession):
+    """
+    Сессия без сети: сериализует запрос и разбирает фиктивный ответ
+    теми же json_dumps/json_loads, что и настоящая сессия
+    """
+
+    def __init__(self, latency: float = 0.0, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.requests: Dict[str, int] = {}
+        self._thread_ids = itertools.count(1_000_000)
+        self._message_ids = itertools.count(1)
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None):
+        name = method.__api_method__
+        self.requests[name] = self.requests.get(name, 0) + 1
+
+        # Подготовка полей так же, как при отправке формы
+        files: Dict[str, Any] = {}
+        for value in method.model_dump(warnings=False).values():
+            self.prepare_value(value, bot=bot, files=files)
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        content = self.json_dumps({'ok': True, 'result': self._fake_result(method)})
+        response = self.check_response(bot=bot, method=method, status_code=200, content=content)
+        return response.result
+
+    def _fake_result(self, method: TelegramMethod) -> Any:
+        """Минимальный корректный ответ Bot API для метода"""
+        name = method.__api_method__
+        chat_id = getattr(method, 'chat_id', None) or 1
+
+        if name == 'getMe':
+            return BOT_USER
+        if name == 'getChat':
+            return {
+                'id': chat_id, 'type': 'private', 'accent_color_id': 0,
+                'max_reaction_count': 11, 'accepted_gift_types': {
+                    'unlimited_gifts': True, 'limited_gifts': True,
+                    'unique_gifts': True, 'premium_subscription': True,
+                    'gifts_from_channels': True,
+                },
+            }
+        if name == 'createForumTopic':
+            return {
+                'message_thread_id': next(self._thread_ids),
+                'name': method.name,
+                'icon_color': method.icon_color or 0x6FB9F0,
+            }
+        if name in ('sendMessage', 'editMessageText', 'sendDocument'):
+            return make_message(chat_id, getattr(method, 'text', None) or '', bot=True,
+                                message_id=next(self._message_ids))
+        return True
+
+
+def make_bot(fast: bool = False, latency: float = 0.0) -> Bot:
+    """Бот со StubSession, кодеками выбранного профиля и хранилищем топиков в памяти"""
+    from src import bot as app, runtime
+    from src.storage import TopicDatabase, TopicStore
+
+    session = StubSession(latency=latency, **runtime.get_json_codecs(fast))
+    bot = Bot(token=BENCH_TOKEN, session=session)
+    app.bots_topics[bot.id] = TopicStore(bot.id, TopicDatabase(":memory:"), app.topics_cache)
+    return bot
+
+
+def disable_throttling():
+    """Замеряются обработчики, а не защита от флуда"""
+    from src import bot as app
+
+    app.throttler.limits.clear()
+    app.throttler.coalesce_window = 0
+
+
+def release_bot(bot: Bot):
+    """Удаление хранилища и записей кэша бота после замера"""
+    from src import bot as app
+
+    store = app.bots_topics.pop(bot.id, None)
+    if store is not None:
+        store.db.close()
+    app.topics_cache.drop_bot(bot.id)
+
+
+_update_ids = itertools.count(1)
+
+
+def make_user(user_id: int) -> Dict[str, Any]:
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+
+
+def make_message(chat_id: int, text: str, thread_id: Optional[int] = None,
+                 bot: bool = False, message_id: int = 1) -> Dict[str, Any]:
+    """Сообщение в личном чате (от пользователя или от бота)"""
+    message = {
+        'message_id': message_id,
+        'date': int(datetime.now().timestamp()),
+        'chat': {'id': chat_id, 'type': 'private', 'first_name': f'User{chat_id}'},
+        'from': BOT_USER if bot else make_user(chat_id),
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    if thread_id:
+        message['message_thread_id'] = thread_id
+        message['is_topic_message'] = True
+    return message
+
+
+def message_update(user_id: int, text: str, thread_id: Optional[int] = None) -> Dict[str, Any]:
+    """Обновление с текстовым сообщением или командой"""
+    return {'update_id': next(_update_ids), 'message': make_message(user_id, text, thread_id)}
+
+
+def callback_update(user_id: int, data: str) -> Dict[str, Any]:
+    """Обновление с нажатием inline-кнопки под сообщением бота"""
+    return {
+        'update_id': next(_update_ids),
+        'callback_query': {
+            'id': str(next(_update_ids)),
+            'from': make_user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': make_message(user_id, 'menu', bot=True),
+        },
+    }
+
+
+def seed_topics(user_topics, user_id: int, count: int, first_id: int = 100) -> list:
+    """Заполнение хранилища пользователя топиками; возвращает их ID"""
+    for topic_id in range(first_id, first_id + count):
+        user_topics.save_topic(user_id, topic_id, {
+            'name': f'Топик {topic_id}',
+            'icon_color': hex(0x6FB9F0),
+            'color_name': '🔵 Синий',
+            'created_at': datetime.now().strftime('%d.%m.%Y %H:%M:%S'),
+            'is_closed': topic_id % 3 == 0,
+            'is_pinned': topic_id % 5 == 0,
+            'messages_count': 0,
+        })
+    return list(range(first_id, first_id + count))
@@ -6,15 +6,28 @@ Telegram бот с полной поддержкой топиков в личн
 import asyncio
 import logging
 import os
+import tempfile
 from datetime import datetime
-from typing import Dict, Any
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 
 from aiogram import Bot, Dispatcher, F, types
-from aiogram.filters import Command
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile, TelegramObject
 from aiogram.enums import ParseMode
-from aiogram.exceptions import TelegramBadRequest
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
 from src.configs.config import settings
+from src import runtime
+from src.lifecycle import (
+    LifecycleScheduler, RetryLater, ACTION_CLOSE, ACTION_DELETE, MAX_POLICY_DAYS, is_valid_days
+)
+from src.diagnostics import SamplingProfiler, setup_slow_update_tracing
+from src.broadcast import Broadcaster
+from src.throttling import ThrottlingMiddleware, ANY_ACTION
+from src.export import EXPORT_FORMATS, iter_topic_rows, write_export
+from src.supervisor import HashRing, Supervisor, consume_updates
+from src.storage import HotCache, TopicDatabase, TopicStore
 
 # Настройка логирования
 logging.basicConfig(
@@ -23,15 +36,58 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Получение токена из переменных окружения или напрямую
-BOT_TOKEN = settings.TELEGRAM_BOT_TOKEN
-
-# Инициализация бота и диспетчера
-bot = Bot(token=BOT_TOKEN)
+# Один диспетчер (и одни обработчики) на все боты процесса
 dp = Dispatcher()
 
-# Хранилище топиков пользователей
-user_topics: Dict[int, Dict[int, Dict[str, Any]]] = {}
+# Защита от флуда: лимиты на все обновления пользователя и на создание топиков
+throttler = ThrottlingMiddleware(
+    limits={
+        name: (limit, 60)
+        for name, limit in (
+            (ANY_ACTION, settings.THROTTLE_UPDATES_PER_MINUTE),
+            ('create', settings.THROTTLE_CREATE_PER_MINUTE),
+            ('export', settings.THROTTLE_EXPORT_PER_MINUTE)
+        )
+        if limit > 0
+    },
+    actions={'create_topic': 'create', 'color_': 'create', '/create': 'create', '/export': 'export'},
+    max_users=settings.THROTTLE_MAX_USERS,
+    idle_ttl=settings.THROTTLE_IDLE_TTL
+)
+dp.message.outer_middleware(throttler)
+dp.callback_query.outer_middleware(throttler)
+
+
+async def track_user_activity(
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+) -> Any:
+    """Обновление от пользователя снимает отметку о блокировке бота (рассылки снова доходят)"""
+    user = getattr(event, 'from_user', None)
+    if user is not None:
+        get_user_topics(data['bot']).mark_active(user.id)
+    return await handler(event, data)
+
+
+dp.message.outer_middleware(track_user_activity)
+dp.callback_query.outer_middleware(track_user_activity)
+
+# Хранилище топиков пользователей, отдельное для каждого бота: bot_id -> (user_id -> topic_id -> info)
+bots_topics: Dict[int, TopicStore] = {}
+
+# Горячий кэш недавно активных пользователей, общий для всех ботов процесса
+topics_cache = HotCache(max_entries=settings.TOPICS_CACHE_MAX_USERS, max_bytes=settings.TOPICS_CACHE_MAX_BYTES)
+topics_db: Optional[TopicDatabase] = None
+
+# Автозакрытие и автоудаление топиков по политикам пользователей
+lifecycle = LifecycleScheduler()
+
+# Профайлер для /profile (один запуск за раз)
+profiler = SamplingProfiler(interval=settings.PROFILE_INTERVAL)
+
+# Рассылки всем пользователям: по одной за раз у каждого бота
+broadcasters: Dict[int, Broadcaster] = {}
 
 # Константы цветов для топиков
 TOPIC_COLORS = {
@@ -53,6 +109,88 @@ COLOR_NAMES = {
 }
 
 
+def create_bots(tokens: List[str], session: Optional[AiohttpSession] = None) -> List[Bot]:
+    """Создание ботов по списку токенов с общим пулом HTTP-соединений"""
+    if not tokens:
+        raise ValueError("Не задан ни один токен бота (TELEGRAM_BOT_TOKEN / TELEGRAM_BOT_TOKENS)")
+
+    session = session or AiohttpSession(**runtime.get_json_codecs(settings.FAST_RUNTIME))
+    bots = [Bot(token=token, session=session) for token in tokens]
+
+    for bot in bots:
+        get_user_topics(bot)
+
+    return bots
+
+
+def get_topics_db() -> TopicDatabase:
+    """База процесса (открывается при первом обращении)"""
+    global topics_db
+
+    if topics_db is None:
+        topics_db = TopicDatabase(settings.TOPICS_DB_FILE)
+    return topics_db
+
+
+def get_user_topics(bot: Bot) -> TopicStore:
+    """Хранилище топиков конкретного бота"""
+    store = bots_topics.get(bot.id)
+    if store is None:
+        store = bots_topics[bot.id] = TopicStore(bot.id, get_topics_db(), topics_cache)
+    return store
+
+
+def get_broadcaster(bot: Bot) -> Broadcaster:
+    """Рассылка конкретного бота"""
+    broadcaster = broadcasters.get(bot.id)
+    if broadcaster is None:
+        broadcaster = broadcasters[bot.id] = Broadcaster(
+            bot,
+            get_user_topics(bot),
+            rate=settings.BROADCAST_RATE,
+            chunk_size=settings.BROADCAST_CHUNK_SIZE,
+            workers=settings.BROADCAST_WORKERS
+        )
+    return broadcaster
+
+
+def log_memory_usage(bots: List[Bot]):
+    """Отчет о памяти горячего кэша по ботам"""
+    cached_bytes = topics_cache.bytes_by_bot()
+    for bot in bots:
+        logger.info(
+            f"📦 Бот {bot.id}: пользователей {len(get_user_topics(bot))}, "
+            f"в кэше ~{cached_bytes.get(bot.id, 0) / 1024:.1f} KB"
+        )
+
+    stats = topics_cache.stats()
+    logger.info(
+        f"🔥 Кэш топиков: записей {stats['entries']}, ~{stats['bytes'] / 1024:.1f} KB, "
+        f"попаданий {stats['hit_rate']:.1%}, загрузок {stats['loads']}, вытеснено {stats['evictions']}"
+    )
+
+
+async def memory_report_loop(bots: List[Bot], interval: int):
+    """Периодический отчет о памяти по ботам"""
+    while True:
+        await asyncio.sleep(interval)
+        log_memory_usage(bots)
+
+
+async def flush_topics():
+    """Запись накопленных изменений всех хранилищ в базу"""
+    for store in list(bots_topics.values()):
+        await store.flush()
+
+
+async def topics_flush_loop(interval: float):
+    """Периодическая запись изменений топиков пачками"""
+    while True:
+        await asyncio.sleep(interval)
+        await flush_topics()
+
+
+@lru_cache(maxsize=None)
 def get_main_menu_keyboard() -> InlineKeyboardMarkup:
     """Главное меню бота"""
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -71,6 +209,7 @@ def get_main_menu_keyboard() -> InlineKeyboardMarkup:
     return keyboard
 
 
+@lru_cache(maxsize=None)
 def get_color_selection_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура выбора цвета для топика"""
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -93,6 +232,7 @@ def get_color_selection_keyboard() -> InlineKeyboardMarkup:
     return keyboard
 
 
+@lru_cache(maxsize=1024)
 def get_topic_actions_keyboard(topic_id: int) -> InlineKeyboardMarkup:
     """Клавиатура с действиями для топика"""
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -124,12 +264,13 @@ def get_topic_actions_keyboard(topic_id: int) -> InlineKeyboardMarkup:
 @dp.message(Command("start"))
 async def cmd_start(message: Message):
     """Обработчик команды /start"""
+    user_topics = get_user_topics(message.bot)
     user_id = message.from_user.id
     user_name = message.from_user.first_name or "пользователь"
 
     try:
         # Получаем информацию о пользователе
-        user_info = await bot.get_chat(user_id)
+        user_info = await message.bot.get_chat(user_id)
         allows_topics = getattr(user_info, 'allows_users_to_create_topics', None)
 
         welcome_text = (
@@ -162,9 +303,8 @@ async def cmd_start(message: Message):
             reply_markup=get_main_menu_keyboard()
         )
 
-        # Инициализация хранилища
-        if user_id not in user_topics:
-            user_topics[user_id] = {}
+        # Регистрация пользователя и прогрев кэша
+        user_topics.prefetch(user_id)
 
         logger.info(f"Пользователь {user_id} ({user_name}) запустил бота. Topics: {allows_topics}")
 
@@ -188,7 +328,10 @@ async def cmd_help(message: Message):
         "/create - Создать топик\n"
         "/list - Список топиков\n"
         "/info - Информация о топике\n"
-        "/stats - Статистика\n\n"
+        "/stats - Статистика\n"
+        "/export [jsonl|csv] - Выгрузка топиков в файл\n"
+        "/autoclose N - Закрывать топики без сообщений N дней\n"
+        "/autodelete M - Удалять закрытые топики через M дней\n\n"
 
         "<b>🔹 Возможности:</b>\n"
         "• Создание топиков с разными цветами\n"
@@ -235,6 +378,7 @@ async def cmd_list_topics(message: Message):
 @dp.message(Command("stats"))
 async def cmd_stats(message: Message):
     """Статистика топиков"""
+    user_topics = get_user_topics(message.bot)
     user_id = message.from_user.id
     topics = user_topics.get(user_id, {})
 
@@ -280,9 +424,165 @@ async def cmd_stats(message: Message):
     )
 
 
+@dp.message(Command("export"))
+async def cmd_export(message: Message, command: CommandObject):
+    """Выгрузка топиков пользователя в сжатый файл"""
+    user_topics = get_user_topics(message.bot)
+    user_id = message.from_user.id
+    fmt = (command.args or "jsonl").strip().lower()
+
+    if fmt not in EXPORT_FORMATS:
+        await message.answer(
+            f"Использование: <code>/export [{'|'.join(EXPORT_FORMATS)}]</code>",
+            parse_mode=ParseMode.HTML
+        )
+        return
+
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}.gz")
+    os.close(fd)
+    try:
+        # Топики читаются из базы страницами, без загрузки всей карты в кэш
+        count = await write_export(iter_topic_rows(user_id, user_topics.iter_topics(user_id)), path, fmt)
+        if not count:
+            await message.answer(
+                "📭 <b>Топиков пока нет</b>\n\n"
+                "Выгружать нечего - создайте первый топик!",
+                parse_mode=ParseMode.HTML,
+                reply_markup=get_main_menu_keyboard()
+            )
+            return
+        await message.answer_document(
+            FSInputFile(path, filename=f"topics_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}.gz"),
+            caption=f"📦 Выгрузка топиков: {count} шт."
+        )
+    finally:
+        os.remove(path)
+
+    logger.info(f"Выгрузка {count} топиков ({fmt}) для {user_id}")
+
+
+@dp.message(Command("profile"))
+async def cmd_profile(message: Message, command: CommandObject):
+    """Сэмплирующее профилирование на N секунд (только для администраторов)"""
+    if message.from_user.id not in settings.admin_ids:
+        await message.answer("⛔ Команда доступна только администраторам")
+        return
+
+    try:
+        seconds = int(command.args or 10)
+    except ValueError:
+        await message.answer("Использование: <code>/profile N</code> (секунды)", parse_mode=ParseMode.HTML)
+        return
+    seconds = max(1, min(seconds, settings.PROFILE_MAX_SECONDS))
+
+    # Проверка и захват без await между ними: второй /profile не пройдет проверку
+    if not profiler.claim():
+        await message.answer("⏳ Профилирование уже запущено")
+        return
+
+    try:
+        await message.answer(f"🔬 Профилирование {seconds} с...")
+        await profiler.profile(seconds)
+
+        fd, path = tempfile.mkstemp(suffix=".folded")
+        os.close(fd)
+        try:
+            samples = profiler.write_collapsed(path)
+            await message.answer_document(
+                FSInputFile(path, filename=f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.folded"),
+                caption=f"🔥 Свернутые стеки: {samples} сэмплов за {seconds} с\n"
+                        f"Открыть: speedscope.app или flamegraph.pl"
+            )
+        finally:
+            os.remove(path)
+    finally:
+        profiler.release()
+
+    logger.info(f"Профилирование {seconds} с для {message.from_user.id}: {samples} сэмплов")
+
+
+@dp.message(Command("throttle"))
+async def cmd_throttle_stats(message: Message):
+    """Счетчики защиты от флуда (только для администраторов)"""
+    if message.from_user.id not in settings.admin_ids:
+        await message.answer("⛔ Команда доступна только администраторам")
+        return
+
+    stats = throttler.stats()
+    dropped = "\n".join(f"   {action}: {count}" for action, count in stats['dropped'].items()) or "   нет"
+    await message.answer(
+        f"🛡 <b>Защита от флуда</b>\n\n"
+        f"✅ <b>Пропущено:</b> {stats['allowed']}\n"
+        f"👆 <b>Двойных нажатий:</b> {stats['coalesced']}\n"
+        f"👥 <b>Отслеживается:</b> {stats['tracked_users']} (вытеснено {stats['evicted']})\n"
+        f"⛔ <b>Отброшено по действиям:</b>\n{dropped}",
+        parse_mode=ParseMode.HTML
+    )
+
+
+@dp.message(Command("cache"))
+async def cmd_cache_stats(message: Message):
+    """Метрики горячего кэша топиков (только для администраторов)"""
+    if message.from_user.id not in settings.admin_ids:
+        await message.answer("⛔ Команда доступна только администраторам")
+        return
+
+    stats = topics_cache.stats()
+    await message.answer(
+        f"🔥 <b>Кэш топиков</b>\n\n"
+        f"👥 <b>Записей:</b> {stats['entries']} / {topics_cache.max_entries}\n"
+        f"💾 <b>Объем:</b> ~{stats['bytes'] / 1024:.1f} KB\n"
+        f"🎯 <b>Попаданий:</b> {stats['hit_rate']:.1%} ({stats['hits']} / {stats['hits'] + stats['misses']})\n"
+        f"📥 <b>Загрузок из базы:</b> {stats['loads']}\n"
+        f"📤 <b>Записей в базу:</b> {stats['writes']}\n"
+        f"♻️ <b>Вытеснено:</b> {stats['evictions']}",
+        parse_mode=ParseMode.HTML
+    )
+
+
+@dp.message(Command("broadcast", "broadcast_topics"))
+async def cmd_broadcast(message: Message, command: CommandObject):
+    """Рассылка всем пользователям (только для администраторов)"""
+    if message.from_user.id not in settings.admin_ids:
+        await message.answer("⛔ Команда доступна только администраторам")
+        return
+
+    if command.args == "stop":
+        if await get_broadcaster(message.bot).cancel():
+            await message.answer("⏹ Рассылка остановлена")
+        else:
+            await message.answer("Рассылка не идет")
+        return
+
+    if not command.args:
+        await message.answer(
+            "📣 <b>Рассылка</b>\n\n"
+            "<code>/broadcast текст</code> - в основной чат каждого пользователя\n"
+            "<code>/broadcast_topics текст</code> - в каждый открытый топик\n"
+            "<code>/broadcast stop</code> - остановить",
+            parse_mode=ParseMode.HTML
+        )
+        return
+
+    status = await message.answer("📣 Рассылка запускается...")
+    started = await get_broadcaster(message.bot).start(
+        chat_id=message.chat.id,
+        status_message_id=status.message_id,
+        text=command.args,
+        to_topics=command.command == "broadcast_topics"
+    )
+    if not started:
+        # Прогресс общий для всех процессов-обработчиков: рассылка может идти в другом
+        await status.edit_text("⏳ Рассылка уже идет. Остановить: <code>/broadcast stop</code>",
+                               parse_mode=ParseMode.HTML)
+        return
+    logger.info(f"Рассылка запущена администратором {message.from_user.id}")
+
+
 @dp.message(Command("info"))
 async def cmd_info(message: Message):
     """Информация о текущем топике"""
+    user_topics = get_user_topics(message.bot)
     topic_id = message.message_thread_id
     user_id = message.from_user.id
 
@@ -329,6 +629,91 @@ async def cmd_info(message: Message):
     )
 
 
+@dp.message(Command("autoclose", "autodelete"))
+async def cmd_lifecycle_policy(message: Message, command: CommandObject):
+    """Настройка автозакрытия / автоудаления топиков"""
+    user_topics = get_user_topics(message.bot)
+    user_id = message.from_user.id
+    bot_id = message.bot.id
+
+    try:
+        days = float((command.args or "").replace(",", "."))
+        # float() принимает nan и inf
+        if not is_valid_days(days):
+            raise ValueError
+    except ValueError:
+        policy = lifecycle.get_policy(bot_id, user_id)
+        close_days = f"{policy['close_days']:g} дн." if 'close_days' in policy else "выкл"
+        delete_days = f"{policy['delete_days']:g} дн." if 'delete_days' in policy else "выкл"
+        await message.answer(
+            f"⏰ <b>Жизненный цикл топиков</b>\n\n"
+            f"🔒 <b>Автозакрытие:</b> {close_days}\n"
+            f"❌ <b>Автоудаление:</b> {delete_days}\n\n"
+            f"Использование: <code>/{command.command} N</code> (0 - выключить, не больше {MAX_POLICY_DAYS})",
+            parse_mode=ParseMode.HTML
+        )
+        return
+
+    topics = user_topics.get(user_id, {})
+
+    if command.command == "autoclose":
+        lifecycle.set_policy(bot_id, user_id, close_days=days)
+        for topic_id, info in topics.items():
+            if not info.get('is_closed'):
+                lifecycle.touch(bot_id, user_id, topic_id)
+        text = f"🔒 Топики без сообщений {days:g} дн. будут закрываться" if days else "🔒 Автозакрытие выключено"
+    else:
+        lifecycle.set_policy(bot_id, user_id, delete_days=days)
+        for topic_id, info in topics.items():
+            if info.get('is_closed'):
+                lifecycle.closed(bot_id, user_id, topic_id)
+        text = f"❌ Закрытые топики будут удаляться через {days:g} дн." if days else "❌ Автоудаление выключено"
+
+    await message.answer(text, reply_markup=get_main_menu_keyboard())
+    logger.info(f"Политика жизненного цикла {user_id}: {lifecycle.get_policy(bot_id, user_id)}")
+
+
+async def run_lifecycle_action(bot: Bot, user_id: int, topic_id: int, action: str):
+    """
+    Выполнение наступившего действия жизненного цикла
+    Локальное состояние меняется только после успеха или если топика уже нет в Telegram;
+    при временных ошибках действие откладывается (RetryLater)
+    """
+    store = get_user_topics(bot)
+
+    try:
+        if action == ACTION_CLOSE:
+            await bot.close_forum_topic(chat_id=user_id, message_thread_id=topic_id)
+        elif action == ACTION_DELETE:
+            await bot.delete_forum_topic(chat_id=user_id, message_thread_id=topic_id)
+    except TelegramRetryAfter as e:
+        raise RetryLater(e.retry_after) from e
+    except (TelegramNetworkError, TelegramServerError) as e:
+        raise RetryLater() from e
+    except TelegramBadRequest as e:
+        if "TOPIC_ID_INVALID" in e.message:
+            # Топик удален вручную - локальное состояние больше не нужно
+            store.delete_topic(user_id, topic_id)
+            lifecycle.forget(bot.id, user_id, topic_id)
+            logger.info(f"Топик {topic_id} пользователя {user_id} уже удален")
+            return
+        # Уже закрыт вручную - результат тот же
+        if not (action == ACTION_CLOSE and "TOPIC_NOT_MODIFIED" in e.message):
+            raise
+
+    if action == ACTION_CLOSE:
+        topics = store.get(user_id, {})
+        if topic_id in topics:
+            topics[topic_id]['is_closed'] = True
+            store.save_topic(user_id, topic_id, topics[topic_id])
+        lifecycle.closed(bot.id, user_id, topic_id)
+        logger.info(f"Топик {topic_id} пользователя {user_id} автоматически закрыт")
+
+    elif action == ACTION_DELETE:
+        store.delete_topic(user_id, topic_id)
+        logger.info(f"Топик {topic_id} пользователя {user_id} автоматически удален")
+
+
 async def create_new_topic(
         user_id: int,
         topic_name: str,
@@ -336,20 +721,18 @@ async def create_new_topic(
         icon_color: int = 0x6FB9F0
 ):
     """Создание нового топика"""
+    user_topics = get_user_topics(message.bot)
     try:
-        topic = await bot.create_forum_topic(
+        topic = await message.bot.create_forum_topic(
             chat_id=user_id,
             name=topic_name,
             icon_color=icon_color
         )
 
         # Сохранение информации
-        if user_id not in user_topics:
-            user_topics[user_id] = {}
-
         color_name = COLOR_NAMES.get(icon_color, 'Неизвестный')
 
-        user_topics[user_id][topic.message_thread_id] = {
+        user_topics.save_topic(user_id, topic.message_thread_id, {
             'name': topic_name,
             'icon_color': hex(icon_color),
             'color_name': color_name,
@@ -357,7 +740,8 @@ async def create_new_topic(
             'is_closed': False,
             'is_pinned': False,
             'messages_count': 0
-        }
+        })
+        lifecycle.touch(message.bot.id, user_id, topic.message_thread_id)
 
         success_text = (
             f"✅ <b>Топик создан!</b>\n\n"
@@ -368,7 +752,7 @@ async def create_new_topic(
         )
 
         # Отправка в топик
-        await bot.send_message(
+        await message.bot.send_message(
             chat_id=user_id,
             text=success_text,
             message_thread_id=topic.message_thread_id,
@@ -410,6 +794,7 @@ async def create_new_topic(
 
 async def show_user_topics(user_id: int, message: Message):
     """Показать список топиков"""
+    user_topics = get_user_topics(message.bot)
     topics = user_topics.get(user_id, {})
 
     if not topics:
@@ -544,6 +929,7 @@ async def callback_list_topics(callback: types.CallbackQuery):
 @dp.callback_query(F.data.startswith("topic_info_"))
 async def callback_topic_info(callback: types.CallbackQuery):
     """Подробная информация о топике"""
+    user_topics = get_user_topics(callback.bot)
     topic_id = int(callback.data.split("_")[-1])
     user_id = callback.from_user.id
 
@@ -578,20 +964,23 @@ async def callback_topic_info(callback: types.CallbackQuery):
 @dp.callback_query(F.data.startswith("rename_"))
 async def callback_rename_topic(callback: types.CallbackQuery):
     """Переименование топика"""
+    user_topics = get_user_topics(callback.bot)
     topic_id = int(callback.data.split("_")[-1])
     user_id = callback.from_user.id
 
     try:
         new_name = f"✅ Переименован {datetime.now().strftime('%H:%M')}"
 
-        await bot.edit_forum_topic(
+        await callback.bot.edit_forum_topic(
             chat_id=user_id,
             message_thread_id=topic_id,
             name=new_name
         )
 
-        if user_id in user_topics and topic_id in user_topics[user_id]:
-            user_topics[user_id][topic_id]['name'] = new_name
+        topics = user_topics.get(user_id, {})
+        if topic_id in topics:
+            topics[topic_id]['name'] = new_name
+            user_topics.save_topic(user_id, topic_id, topics[topic_id])
 
         await callback.answer(f"✅ Топик переименован!", show_alert=True)
         await callback_topic_info(callback)
@@ -605,6 +994,7 @@ async def callback_rename_topic(callback: types.CallbackQuery):
 @dp.callback_query(F.data.startswith("change_color_"))
 async def callback_change_color(callback: types.CallbackQuery):
     """Смена цвета топика"""
+    user_topics = get_user_topics(callback.bot)
     topic_id = int(callback.data.split("_")[-1])
     user_id = callback.from_user.id
 
@@ -614,15 +1004,17 @@ async def callback_change_color(callback: types.CallbackQuery):
     color_name = COLOR_NAMES.get(new_color, 'Неизвестный')
 
     try:
-        await bot.edit_forum_topic(
+        await callback.bot.edit_forum_topic(
             chat_id=user_id,
             message_thread_id=topic_id,
             icon_color=new_color
         )
 
-        if user_id in user_topics and topic_id in user_topics[user_id]:
-            user_topics[user_id][topic_id]['icon_color'] = hex(new_color)
-            user_topics[user_id][topic_id]['color_name'] = color_name
+        topics = user_topics.get(user_id, {})
+        if topic_id in topics:
+            topics[topic_id]['icon_color'] = hex(new_color)
+            topics[topic_id]['color_name'] = color_name
+            user_topics.save_topic(user_id, topic_id, topics[topic_id])
 
         await callback.answer(f"✅ Цвет изменен на {color_name}!", show_alert=True)
         await callback_topic_info(callback)
@@ -636,17 +1028,21 @@ async def callback_change_color(callback: types.CallbackQuery):
 @dp.callback_query(F.data.startswith("close_"))
 async def callback_close_topic(callback: types.CallbackQuery):
     """Закрытие топика"""
+    user_topics = get_user_topics(callback.bot)
     topic_id = int(callback.data.split("_")[-1])
     user_id = callback.from_user.id
 
     try:
-        await bot.close_forum_topic(
+        await callback.bot.close_forum_topic(
             chat_id=user_id,
             message_thread_id=topic_id
         )
 
-        if user_id in user_topics and topic_id in user_topics[user_id]:
-            user_topics[user_id][topic_id]['is_closed'] = True
+        topics = user_topics.get(user_id, {})
+        if topic_id in topics:
+            topics[topic_id]['is_closed'] = True
+            user_topics.save_topic(user_id, topic_id, topics[topic_id])
+        lifecycle.closed(callback.bot.id, user_id, topic_id)
 
         await callback.answer("🔒 Топик закрыт", show_alert=True)
         await callback_topic_info(callback)
@@ -658,17 +1054,21 @@ async def callback_close_topic(callback: types.CallbackQuery):
 @dp.callback_query(F.data.startswith("reopen_"))
 async def callback_reopen_topic(callback: types.CallbackQuery):
     """Открытие топика"""
+    user_topics = get_user_topics(callback.bot)
     topic_id = int(callback.data.split("_")[-1])
     user_id = callback.from_user.id
 
     try:
-        await bot.reopen_forum_topic(
+        await callback.bot.reopen_forum_topic(
             chat_id=user_id,
             message_thread_id=topic_id
         )
 
-        if user_id in user_topics and topic_id in user_topics[user_id]:
-            user_topics[user_id][topic_id]['is_closed'] = False
+        topics = user_topics.get(user_id, {})
+        if topic_id in topics:
+            topics[topic_id]['is_closed'] = False
+            user_topics.save_topic(user_id, topic_id, topics[topic_id])
+        lifecycle.touch(callback.bot.id, user_id, topic_id)
 
         await callback.answer("🔓 Топик открыт", show_alert=True)
         await callback_topic_info(callback)
@@ -680,11 +1080,14 @@ async def callback_reopen_topic(callback: types.CallbackQuery):
 @dp.callback_query(F.data.startswith("pin_"))
 async def callback_pin_topic(callback: types.CallbackQuery):
     """Закрепление топика (локально)"""
+    user_topics = get_user_topics(callback.bot)
     topic_id = int(callback.data.split("_")[-1])
     user_id = callback.from_user.id
 
-    if user_id in user_topics and topic_id in user_topics[user_id]:
-        user_topics[user_id][topic_id]['is_pinned'] = True
+    topics = user_topics.get(user_id, {})
+    if topic_id in topics:
+        topics[topic_id]['is_pinned'] = True
+        user_topics.save_topic(user_id, topic_id, topics[topic_id])
         await callback.answer("📌 Топик закреплен", show_alert=True)
         await callback_topic_info(callback)
     else:
@@ -694,11 +1097,14 @@ async def callback_pin_topic(callback: types.CallbackQuery):
 @dp.callback_query(F.data.startswith("unpin_"))
 async def callback_unpin_topic(callback: types.CallbackQuery):
     """Открепление топика"""
+    user_topics = get_user_topics(callback.bot)
     topic_id = int(callback.data.split("_")[-1])
     user_id = callback.from_user.id
 
-    if user_id in user_topics and topic_id in user_topics[user_id]:
-        user_topics[user_id][topic_id]['is_pinned'] = False
+    topics = user_topics.get(user_id, {})
+    if topic_id in topics:
+        topics[topic_id]['is_pinned'] = False
+        user_topics.save_topic(user_id, topic_id, topics[topic_id])
         await callback.answer("📍 Топик откреплен", show_alert=True)
         await callback_topic_info(callback)
 
@@ -706,19 +1112,21 @@ async def callback_unpin_topic(callback: types.CallbackQuery):
 @dp.callback_query(F.data.startswith("delete_"))
 async def callback_delete_topic(callback: types.CallbackQuery):
     """Удаление топика"""
+    user_topics = get_user_topics(callback.bot)
     topic_id = int(callback.data.split("_")[-1])
     user_id = callback.from_user.id
 
     try:
-        await bot.delete_forum_topic(
+        await callback.bot.delete_forum_topic(
             chat_id=user_id,
             message_thread_id=topic_id
         )
 
         topic_name = "Топик"
-        if user_id in user_topics and topic_id in user_topics[user_id]:
-            topic_name = user_topics[user_id][topic_id]['name']
-            del user_topics[user_id][topic_id]
+        deleted = user_topics.delete_topic(user_id, topic_id)
+        if deleted is not None:
+            topic_name = deleted['name']
+        lifecycle.forget(callback.bot.id, user_id, topic_id)
 
         await callback.answer(f"✅ '{topic_name}' удален", show_alert=True)
         await show_user_topics(user_id, callback.message)
@@ -778,15 +1186,20 @@ async def callback_about(callback: types.CallbackQuery):
 @dp.message(F.text & ~F.command())
 async def handle_text_message(message: Message):
     """Обработка текстовых сообщений"""
+    user_topics = get_user_topics(message.bot)
     topic_id = message.message_thread_id
     user_id = message.from_user.id
 
     if topic_id:
-        topic_info = user_topics.get(user_id, {}).get(topic_id)
+        topics = user_topics.get(user_id, {})
+        topic_info = topics.get(topic_id)
 
         # Обновляем счетчик сообщений
         if topic_info:
             topic_info['messages_count'] = topic_info.get('messages_count', 0) + 1
+            user_topics.save_topic(user_id, topic_id, topic_info)
+            if not topic_info.get('is_closed'):
+                lifecycle.touch(message.bot.id, user_id, topic_id)
 
         response = (
             f"💬 <b>Сообщение в топике!</b>\n\n"
@@ -818,31 +1231,126 @@ async def handle_text_message(message: Message):
         )
 
 
+def start_services(bots: List[Bot], owns: Optional[Callable[[int], bool]] = None) -> List[asyncio.Task]:
+    """
+    Запуск фоновых задач: отчет о памяти, жизненный цикл топиков, прерванная рассылка
+    owns - пользователи, закрепленные за процессом (режим супервизора)
+    """
+    bots_by_id = {bot.id: bot for bot in bots}
+    tasks = []
+
+    async def execute_lifecycle(key, action):
+        bot_id, user_id, topic_id = key
+        if bot_id in bots_by_id:
+            await run_lifecycle_action(bots_by_id[bot_id], user_id, topic_id, action)
+
+    if settings.MEMORY_REPORT_INTERVAL > 0:
+        tasks.append(asyncio.create_task(
+            memory_report_loop(bots, settings.MEMORY_REPORT_INTERVAL)
+        ))
+
+    tasks.append(asyncio.create_task(topics_flush_loop(settings.TOPICS_FLUSH_INTERVAL)))
+
+    lifecycle.load(get_topics_db(), owns)
+    for bot in bots:
+        get_broadcaster(bot).resume(owns)
+    tasks.append(asyncio.create_task(lifecycle.run(
+        execute_lifecycle,
+        tick=settings.LIFECYCLE_TICK,
+        batch_size=settings.LIFECYCLE_BATCH_SIZE,
+        rate=settings.LIFECYCLE_RATE
+    )))
+    return tasks
+
+
+async def stop_services(bots: List[Bot], tasks: List[asyncio.Task]):
+    """Остановка фоновых задач с сохранением состояния"""
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for broadcaster in broadcasters.values():
+        await broadcaster.stop()
+    await lifecycle.save()
+    await flush_topics()
+    log_memory_usage(bots)
+    if topics_db is not None:
+        topics_db.close()
+    # Сессия общая для всех ботов - закрываем один раз
+    await bots[0].session.close()
+
+
+async def run_worker(index: int, updates, handled):
+    """Процесс-обработчик в режиме супервизора: обновления приходят из очереди"""
+    bots = create_bots(settings.bot_tokens)
+    setup_slow_update_tracing(dp, bots[0].session, settings.SLOW_UPDATE_THRESHOLD)
+
+    # Пользователь закреплен за процессом, который получает его обновления: таймеры и рассылка
+    # берутся из общей базы по тому же кольцу, поэтому смена WORKERS их перераспределяет
+    ring = HashRing(settings.WORKERS)
+
+    tasks = start_services(bots, owns=lambda user_id: ring.get_node(user_id) == index)
+    logger.info(f"🧩 Процесс-обработчик #{index} запущен")
+    try:
+        await consume_updates(dp, bots, updates, handled, settings.WORKER_MAX_IN_FLIGHT)
+    finally:
+        await stop_services(bots, tasks)
+
+
+def worker_process(index: int, updates, handled):
+    """Точка входа процесса-обработчика"""
+    try:
+        runtime.run(run_worker(index, updates, handled), fast=settings.FAST_RUNTIME)
+    except KeyboardInterrupt:
+        pass
+
+
 async def main():
     """Главная функция"""
-    logger.info("🚀 Запуск бота топиков (Bot API 9.4)...")
+    logger.info(f"🚀 Запуск бота топиков (Bot API 9.4), профиль {runtime.describe(settings.FAST_RUNTIME)}...")
+
+    bots = create_bots(settings.bot_tokens)
+    supervised = settings.WORKERS > 1
+    tasks = []
 
     try:
-        await bot.delete_webhook(drop_pending_updates=True)
+        for bot in bots:
+            await bot.delete_webhook(drop_pending_updates=True)
+
+            bot_info = await bot.get_me()
+            logger.info(f"✅ Бот @{bot_info.username} запущен!")
 
-        bot_info = await bot.get_me()
-        logger.info(f"✅ Бот @{bot_info.username} запущен!")
+        logger.info(f"🤖 Ботов в процессе: {len(bots)}")
         logger.info("📋 Функции:")
         logger.info("   ✅ Создание топиков")
         logger.info("   ✅ Управление топиками")
         logger.info("   ✅ 6 цветов иконок")
         logger.info("   ✅ Статистика")
 
-        await dp.start_polling(bot)
+        if supervised:
+            await Supervisor(
+                bots=bots,
+                workers=settings.WORKERS,
+                target=worker_process,
+                allowed_updates=dp.resolve_used_update_types(),
+                report_interval=settings.SUPERVISOR_REPORT_INTERVAL
+            ).run()
+        else:
+            setup_slow_update_tracing(dp, bots[0].session, settings.SLOW_UPDATE_THRESHOLD)
+            tasks = start_services(bots)
+            await dp.start_polling(*bots, close_bot_session=False)
 
     except Exception as e:
         logger.error(f"❌ Ошибка: {e}")
     finally:
-        await bot.session.close()
+        if supervised:
+            topics_db.close()
+            await bots[0].session.close()
+        else:
+            await stop_services(bots, tasks)
 
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        runtime.run(main(), fast=settings.FAST_RUNTIME)
     except KeyboardInterrupt:
-        logger.info("⛔ Бот остановлен")
\ No newline at end of file
+        logger.info("⛔ Бот остановлен")
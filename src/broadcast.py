@@ -0,0 +1,341 @@
+"""
+Рассылка сообщений всем пользователям бота
+Получатели читаются из хранилища топиков пачками, прогресс сохраняется в общую базу
+"""
+
+import asyncio
+import json
+import logging
+import time
+from contextlib import suppress
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from src.storage import TopicDatabase, TopicStore
+
+logger = logging.getLogger(__name__)
+
+RESULT_SENT = 'sent'
+RESULT_FAILED = 'failed'
+RESULT_BLOCKED = 'blocked'
+
+STATUS_RUNNING = 'идет'
+STATUS_FINISHED = 'завершена'
+STATUS_STOPPED = 'остановлена'
+
+# Запись прогресса в service_state (с ID бота): одна рассылка бота на все процессы-обработчики
+STATE_KEY = 'broadcast'
+
+
+class TokenBucket:
+    """Ограничитель скорости: не более rate отправок в секунду"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def pause(self, seconds: float):
+        """Пауза для всех отправителей (ответ RetryAfter от Telegram)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class Broadcaster:
+    """Рассылка одного бота с ограничением скорости, повторами и возобновлением после сбоя"""
+
+    def __init__(
+            self,
+            bot: Bot,
+            store: TopicStore,
+            rate: float = 25,
+            chunk_size: int = 500,
+            workers: int = 25,
+            per_chat_interval: float = 1.0,
+            max_retries: int = 3,
+            report_interval: float = 5
+    ):
+        self.bot = bot
+        self.store = store
+        self.db: TopicDatabase = store.db
+        self.state_key = f"{STATE_KEY}:{bot.id}"
+        self.rate = rate
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self.report_interval = report_interval
+
+        self.state: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._notify_task: Optional[asyncio.Task] = None
+        self._bucket: Optional[TokenBucket] = None
+        # Остановка администратором (в отличие от остановки процесса) не возобновляется
+        self._cancelled = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self, chat_id: int, status_message_id: int, text: str, to_topics: bool = False) -> bool:
+        """Запуск новой рассылки; False, если рассылка бота уже идет (в том числе в другом процессе)"""
+        if self.running:
+            return False
+
+        state = {
+            'bot_id': self.bot.id,
+            'chat_id': chat_id,
+            'status_message_id': status_message_id,
+            'text': text,
+            'to_topics': to_topics,
+            # Закладка - последний обработанный ID: страницы читаются по первичному ключу
+            'last_user_id': 0,
+            'processed': 0,
+            'sent': 0,
+            'failed': 0,
+            'blocked': 0,
+            'skipped': 0,
+        }
+        if not await asyncio.to_thread(self.db.insert_state, self.state_key, json.dumps(state)):
+            return False
+
+        self.state = state
+        self._cancelled = False
+        self._launch()
+        return True
+
+    def resume(self, owns: Optional[Callable[[int], bool]] = None) -> bool:
+        """
+        Продолжение прерванной рассылки из базы
+        owns - чаты, закрепленные за процессом: рассылку продолжает процесс администратора,
+        чтобы /broadcast stop попадал в него
+        """
+        data = self.db.load_state(self.state_key)
+        if data is None:
+            return False
+
+        state = json.loads(data)
+        if owns is not None and not owns(state['chat_id']):
+            return False
+
+        self.state = state
+        logger.info(f"📣 Возобновление рассылки бота {self.bot.id}: обработано {state['processed']}")
+        self._launch()
+        return True
+
+    async def cancel(self) -> bool:
+        """Остановка администратором: прогресс сбрасывается, рассылка не возобновится"""
+        if self.running:
+            self._cancelled = True
+            await self.stop()
+            return True
+        # Рассылка другого процесса-обработчика заметит удаление записи после текущей пачки
+        return await asyncio.to_thread(self.db.delete_state, self.state_key)
+
+    async def stop(self):
+        """Остановка процесса: прогресс сохраняется для возобновления"""
+        if self.running:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+
+    # ---------- рассылка ----------
+
+    def _launch(self):
+        self._task = asyncio.create_task(self._run(self.bot, self.store))
+        self._task.add_done_callback(lambda task: self._on_done(task, self.bot))
+
+    def _on_done(self, task: asyncio.Task, bot: Bot):
+        """Рассылка, упавшая с неожиданной ошибкой, не должна пропасть молча"""
+        if task.cancelled() or task.exception() is None:
+            return
+        error = task.exception()
+        logger.error(f"📣 Рассылка прервана ошибкой: {error!r}", exc_info=error)
+        if self.state:
+            # Прогресс последней пачки сохранен - рассылка продолжится после перезапуска
+            self._notify_task = asyncio.create_task(self._notify(
+                bot,
+                f"❌ Рассылка прервана ошибкой: {error}\n"
+                f"Обработано {self.state['processed']}, прогресс сохранен - продолжится после перезапуска"
+            ))
+
+    async def _notify(self, bot: Bot, text: str):
+        try:
+            await bot.send_message(chat_id=self.state['chat_id'], text=text)
+        except TelegramAPIError as e:
+            logger.warning(f"Администратор не уведомлен о сбое рассылки: {e}")
+
+    async def _run(self, bot: Bot, store: TopicStore):
+        state = self.state
+        self._bucket = TokenBucket(self.rate)
+        semaphore = asyncio.Semaphore(self.workers)
+        # Отметки о блокировке хранятся в базе и снимаются, когда пользователь снова пишет боту
+        blocked: Set[int] = set()
+        newly_blocked: List[int] = []
+
+        run_started = time.monotonic()
+        run_processed = state['processed']
+        last_report = 0.0
+
+        async def deliver(user_id: int):
+            async with semaphore:
+                if user_id in blocked:
+                    state['skipped'] += 1
+                    return
+                topics = (store.peek(user_id) or {}) if state['to_topics'] else {}
+                result = await self._deliver(bot, user_id, topics)
+                state[result] += 1
+                if result == RESULT_BLOCKED:
+                    newly_blocked.append(user_id)
+
+        try:
+            # Пользователи, добавившиеся во время рассылки с меньшим ID, ее не получат;
+            # остальные не теряются и не дублируются
+            while True:
+                chunk = await store.user_ids_after(state['last_user_id'], self.chunk_size)
+                if not chunk:
+                    break
+                blocked = await store.blocked_users(chunk)
+                newly_blocked.clear()
+                await asyncio.gather(*(deliver(user_id) for user_id in chunk))
+                if newly_blocked:
+                    await store.mark_blocked(newly_blocked)
+                state['last_user_id'] = chunk[-1]
+                state['processed'] += len(chunk)
+                if not await self._save():
+                    # Запись удалена командой /broadcast stop в другом процессе-обработчике
+                    await self._report(bot, store, run_processed, run_started, STATUS_STOPPED)
+                    logger.info(f"📣 Рассылка остановлена: обработано {state['processed']}")
+                    self.state = None
+                    return
+
+                if time.monotonic() - last_report >= self.report_interval:
+                    await self._report(bot, store, run_processed, run_started)
+                    last_report = time.monotonic()
+
+            await self._report(bot, store, run_processed, run_started, STATUS_FINISHED)
+            logger.info(
+                f"📣 Рассылка завершена: отправлено {state['sent']}, ошибок {state['failed']}, "
+                f"заблокировали {state['blocked']}"
+            )
+            self.state = None
+            await self._save()
+
+        except asyncio.CancelledError:
+            if self._cancelled:
+                await self._report(bot, store, run_processed, run_started, STATUS_STOPPED)
+                logger.info(f"📣 Рассылка остановлена: обработано {state['processed']}")
+                self.state = None
+            await self._save()
+            raise
+
+    async def _deliver(self, bot: Bot, user_id: int, topics: Dict[int, Dict[str, Any]]) -> str:
+        """Отправка пользователю: в основной чат или в каждый открытый топик"""
+        text = self.state['text']
+        if not self.state['to_topics']:
+            return await self._send(bot, chat_id=user_id, text=text)
+
+        thread_ids = [topic_id for topic_id, info in list(topics.items()) if not info.get('is_closed')]
+        if not thread_ids:
+            return await self._send(bot, chat_id=user_id, text=text)
+
+        result = RESULT_FAILED
+        for i, thread_id in enumerate(thread_ids):
+            if i:
+                # Ограничение Telegram на частоту сообщений в один чат
+                await asyncio.sleep(self.per_chat_interval)
+            result = await self._send(bot, chat_id=user_id, text=text, message_thread_id=thread_id)
+            if result == RESULT_BLOCKED:
+                break
+        return result
+
+    async def _send(self, bot: Bot, **kwargs) -> str:
+        """Одна отправка с повторами временных ошибок"""
+        for attempt in range(self.max_retries + 1):
+            await self._bucket.acquire()
+            try:
+                await bot.send_message(**kwargs)
+                return RESULT_SENT
+            except TelegramRetryAfter as e:
+                self._bucket.pause(e.retry_after)
+            except TelegramForbiddenError:
+                return RESULT_BLOCKED
+            except TelegramBadRequest as e:
+                logger.warning(f"Рассылка: {kwargs['chat_id']} - {e.message}")
+                return RESULT_FAILED
+            except (TelegramNetworkError, TelegramServerError) as e:
+                logger.warning(f"Рассылка: {kwargs['chat_id']} - попытка {attempt + 1}: {e}")
+                await asyncio.sleep(2 ** attempt)
+            except TelegramAPIError as e:
+                # Прочие ответы API (например, 404 или 401) не должны обрывать всю пачку в gather
+                logger.warning(f"Рассылка: {kwargs['chat_id']} - {e}")
+                return RESULT_FAILED
+        return RESULT_FAILED
+
+    # ---------- прогресс ----------
+
+    async def _report(self, bot: Bot, store: TopicStore, run_processed: int, run_started: float,
+                      status: str = STATUS_RUNNING):
+        """Обновление одного статусного сообщения у администратора (без гарантии доставки)"""
+        state = self.state
+        done = state['processed']
+        # COUNT(*) проходит по всем пользователям бота: только при отчете и не в цикле событий
+        total = await store.count()
+        elapsed = max(time.monotonic() - run_started, 1e-6)
+        speed = (done - run_processed) / elapsed
+        eta = (total - done) / speed if speed else 0
+
+        text = (
+            f"📣 <b>Рассылка {status}</b>\n\n"
+            f"👥 <b>Обработано:</b> {done} / {total}\n"
+            f"✅ <b>Отправлено:</b> {state['sent']}\n"
+            f"⛔ <b>Заблокировали бота:</b> {state['blocked'] + state['skipped']}\n"
+            f"❌ <b>Ошибок:</b> {state['failed']}\n"
+            f"⚡ <b>Скорость:</b> {speed:.1f} польз./с\n"
+        )
+        if status == STATUS_RUNNING:
+            text += f"⏱ <b>Осталось:</b> ~{int(eta // 60)} мин {int(eta % 60)} с"
+
+        try:
+            await bot.edit_message_text(
+                text=text,
+                chat_id=state['chat_id'],
+                message_id=state['status_message_id'],
+                parse_mode='HTML'
+            )
+        except TelegramBadRequest as e:
+            logger.debug(f"Статус рассылки не обновлен: {e.message}")
+        except TelegramAPIError as e:
+            # Статус - только индикатор: сетевая ошибка или 429 не должны останавливать рассылку
+            logger.warning(f"Статус рассылки не обновлен: {e}")
+
+    async def _save(self) -> bool:
+        """Прогресс в общей базе; False, если запись удалена из другого процесса"""
+        if self.state is None:
+            await asyncio.to_thread(self.db.delete_state, self.state_key)
+            return True
+        return await asyncio.to_thread(self.db.update_state, self.state_key, json.dumps(self.state))
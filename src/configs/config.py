@@ -1,10 +1,65 @@
+from typing import List, Optional, Set
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
 class Settings(BaseSettings):
-    TELEGRAM_BOT_TOKEN: str = None
+    TELEGRAM_BOT_TOKEN: Optional[str] = None
+    # Дополнительные токены через запятую (несколько ботов в одном процессе)
+    TELEGRAM_BOT_TOKENS: Optional[str] = None
+    # Хранилище топиков (SQLite) и горячий кэш: максимум пользователей и байт
+    TOPICS_DB_FILE: str = "topics.db"
+    TOPICS_CACHE_MAX_USERS: int = 10_000
+    TOPICS_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    # Период записи изменений топиков в базу пачками, секунды
+    TOPICS_FLUSH_INTERVAL: float = 1.0
+    # Интервал отчета о памяти по ботам, секунды (0 - выключено)
+    MEMORY_REPORT_INTERVAL: int = 600
+    # Быстрый профиль выполнения: uvloop + orjson (если установлены)
+    FAST_RUNTIME: bool = False
+    # Жизненный цикл топиков (таймеры хранятся в базе): период проверки (с), размер пачки, действий в секунду
+    LIFECYCLE_TICK: float = 30
+    LIFECYCLE_BATCH_SIZE: int = 100
+    LIFECYCLE_RATE: float = 20
+    # ID администраторов через запятую
+    ADMIN_IDS: Optional[str] = None
+    # Порог медленного обновления, секунды (0 - трассировка выключена)
+    SLOW_UPDATE_THRESHOLD: float = 0
+    # Сэмплирующий профайлер /profile: максимум секунд и период сэмплирования
+    PROFILE_MAX_SECONDS: int = 120
+    PROFILE_INTERVAL: float = 0.005
+    # Рассылка (прогресс хранится в базе): сообщений в секунду, размер пачки, параллельных получателей
+    BROADCAST_RATE: float = 25
+    BROADCAST_CHUNK_SIZE: int = 500
+    BROADCAST_WORKERS: int = 25
+    # Защита от флуда: лимиты в минуту (0 - без лимита), число отслеживаемых пользователей, забывать через N секунд
+    THROTTLE_UPDATES_PER_MINUTE: int = 60
+    THROTTLE_CREATE_PER_MINUTE: int = 5
+    THROTTLE_EXPORT_PER_MINUTE: int = 2
+    THROTTLE_MAX_USERS: int = 100_000
+    THROTTLE_IDLE_TTL: float = 600
+    # Режим супервизора: число процессов-обработчиков (1 - один процесс), период отчета (с),
+    # обновлений в работе у процесса-обработчика
+    WORKERS: int = 1
+    SUPERVISOR_REPORT_INTERVAL: float = 60
+    WORKER_MAX_IN_FLIGHT: int = 1000
 
     model_config = SettingsConfigDict(env_file=".env")
 
+    @property
+    def bot_tokens(self) -> List[str]:
+        """Все токены ботов без повторов, в порядке объявления"""
+        tokens = [self.TELEGRAM_BOT_TOKEN] if self.TELEGRAM_BOT_TOKEN else []
+        if self.TELEGRAM_BOT_TOKENS:
+            tokens += [t.strip() for t in self.TELEGRAM_BOT_TOKENS.split(",") if t.strip()]
+        return list(dict.fromkeys(tokens))
+
+    @property
+    def admin_ids(self) -> Set[int]:
+        """ID администраторов бота"""
+        if not self.ADMIN_IDS:
+            return set()
+        return {int(i) for i in self.ADMIN_IDS.split(",") if i.strip()}
+
 
-settings = Settings()
\ No newline at end of file
+settings = Settings()
@@ -0,0 +1,223 @@
+"""
+Диагностика производительности: трассировка медленных обновлений
+и сэмплирующий профайлер со свернутыми стеками (формат flamegraph)
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject, Update
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateTrace:
+    """Замеры одного обновления"""
+    __slots__ = ('handler', 'api_time', 'api_calls', 'stack')
+
+    def __init__(self):
+        self.handler: Optional[str] = None
+        self.api_time = 0.0
+        self.api_calls = 0
+        self.stack: Optional[str] = None
+
+
+_current_trace: ContextVar[Optional[UpdateTrace]] = ContextVar('update_trace', default=None)
+
+
+@contextmanager
+def trace_update() -> Iterator[UpdateTrace]:
+    """Замеры обновления, обрабатываемого внутри блока"""
+    trace = UpdateTrace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def format_await_stack(task: asyncio.Task) -> str:
+    """Цепочка await задачи от обработчика до текущей точки ожидания"""
+    lines = []
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None)
+        if frame is not None:
+            code = frame.f_code
+            lines.append(f'  File "{code.co_filename}", line {frame.f_lineno}, in {code.co_name}')
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None)
+    return "\n".join(lines)
+
+
+class SlowUpdateMiddleware(BaseMiddleware):
+    """Логирование обновлений, обработка которых дольше порога"""
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: Update,
+            data: Dict[str, Any]
+    ) -> Any:
+        task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+
+        with trace_update() as trace:
+            # Стек снимается в момент превышения порога, пока обработчик еще ждет
+            watchdog = loop.call_later(self.threshold, self._capture_stack, trace, task)
+            start = time.perf_counter()
+            try:
+                return await handler(event, data)
+            finally:
+                elapsed = time.perf_counter() - start
+                watchdog.cancel()
+                if elapsed >= self.threshold:
+                    self._report(event, trace, elapsed)
+
+    @staticmethod
+    def _capture_stack(trace: UpdateTrace, task: Optional[asyncio.Task]):
+        if task is not None and not task.done():
+            trace.stack = format_await_stack(task)
+
+    @staticmethod
+    def _report(event: Update, trace: UpdateTrace, elapsed: float):
+        local_time = max(elapsed - trace.api_time, 0.0)
+        stack = trace.stack or "  (стек недоступен: цикл событий был заблокирован синхронным кодом)"
+        logger.warning(
+            f"🐢 Медленное обновление {event.update_id} ({event.event_type}): {elapsed * 1000:.0f} мс, "
+            f"обработчик {trace.handler or '-'}, "
+            f"Telegram API {trace.api_time * 1000:.0f} мс ({trace.api_calls} выз.), "
+            f"локально {local_time * 1000:.0f} мс\n{stack}"
+        )
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    """Запоминает имя выбранного обработчика в текущей трассировке"""
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.handler = data['handler'].callback.__name__
+        return await handler(event, data)
+
+
+class ApiTimingMiddleware(BaseRequestMiddleware):
+    """Учет времени, проведенного в вызовах Telegram API"""
+
+    async def __call__(self, make_request, bot: Bot, method):
+        trace = _current_trace.get()
+        if trace is None:
+            return await make_request(bot, method)
+
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            trace.api_time += time.perf_counter() - start
+            trace.api_calls += 1
+
+
+def setup_slow_update_tracing(dp: Dispatcher, session: BaseSession, threshold: float):
+    """Подключение трассировки; при threshold <= 0 ничего не регистрируется"""
+    if threshold <= 0:
+        return
+
+    dp.update.outer_middleware(SlowUpdateMiddleware(threshold))
+    dp.message.middleware(HandlerNameMiddleware())
+    dp.callback_query.middleware(HandlerNameMiddleware())
+    session.middleware(ApiTimingMiddleware())
+    logger.info(f"🐢 Трассировка медленных обновлений: порог {threshold * 1000:.0f} мс")
+
+
+class SamplingProfiler:
+    """
+    Сэмплирующий профайлер: фоновый поток периодически снимает стек
+    главного потока и считает одинаковые стеки
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: Dict[str, int] = {}
+        self._target_thread = threading.main_thread().ident
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Профайлер занят обработчиком: от проверки до отправки результата
+        self._claimed = False
+
+    @property
+    def running(self) -> bool:
+        return self._claimed or (self._thread is not None and self._thread.is_alive())
+
+    def claim(self) -> bool:
+        """
+        Занять профайлер (до первого await обработчика); False, если он уже занят:
+        параллельный запуск сбросил бы сэмплы текущего
+        """
+        if self.running:
+            return False
+        self._claimed = True
+        return True
+
+    def release(self):
+        self._claimed = False
+
+    def start(self):
+        self.samples = {}
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample_loop, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    async def profile(self, seconds: float) -> Dict[str, int]:
+        """Профилирование в течение seconds без блокировки цикла событий"""
+        self.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            await asyncio.to_thread(self.stop)
+        return self.samples
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target_thread)
+            if frame is None:
+                continue
+            stack = self._collapse(frame)
+            self.samples[stack] = self.samples.get(stack, 0) + 1
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        names: List[str] = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def write_collapsed(self, path: str) -> int:
+        """Запись в формате flamegraph.pl / speedscope; возвращает число сэмплов"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.samples.items()):
+                f.write(f"{stack} {count}\n")
+        return sum(self.samples.values())
@@ -0,0 +1,60 @@
+"""
+Выгрузка топиков пользователя в сжатый файл (JSONL или CSV)
+Данные идут потоком: страницы из базы -> строки -> gzip, без сборки всего содержимого в памяти
+"""
+
+import csv
+import gzip
+import json
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+EXPORT_FORMATS = ('jsonl', 'csv')
+
+EXPORT_FIELDS = [
+    'user_id', 'topic_id', 'name', 'color_name', 'icon_color', 'created_at',
+    'is_closed', 'is_pinned', 'messages_count',
+]
+
+
+async def iter_topic_rows(user_id: int, pages: AsyncIterator[List[Tuple[int, Dict[str, Any]]]]
+                          ) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Пачки строк выгрузки по страницам топиков пользователя (TopicStore.iter_topics)"""
+    async for page in pages:
+        rows = []
+        for topic_id, info in page:
+            rows.append({
+                'user_id': user_id,
+                'topic_id': topic_id,
+                'name': info.get('name'),
+                'color_name': info.get('color_name'),
+                'icon_color': info.get('icon_color'),
+                'created_at': info.get('created_at'),
+                'is_closed': bool(info.get('is_closed')),
+                'is_pinned': bool(info.get('is_pinned')),
+                'messages_count': info.get('messages_count', 0),
+            })
+        yield rows
+
+
+async def write_export(rows: AsyncIterator[List[Dict[str, Any]]], path: str, fmt: str = 'jsonl') -> int:
+    """
+    Потоковая запись пачек строк в gzip-файл; пока читается следующая пачка,
+    цикл событий свободен. Возвращает число записанных строк
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+
+    written = 0
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            writer = csv.DictWriter(f, fieldnames=EXPORT_FIELDS)
+            writer.writeheader()
+
+        async for chunk in rows:
+            if fmt == 'csv':
+                writer.writerows(chunk)
+            else:
+                f.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in chunk)
+            written += len(chunk)
+
+    return written
@@ -0,0 +1,266 @@
+"""
+Жизненный цикл топиков: автозакрытие неактивных и автоудаление закрытых
+Дедлайны хранятся в мин-куче с ленивой отменой (O(log n) на изменение),
+в базу пишутся только изменившиеся таймеры и политики
+"""
+
+import asyncio
+import heapq
+import json
+import logging
+import math
+import sqlite3
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from src.storage import TopicDatabase
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 60 * 60
+
+ACTION_CLOSE = 'close'
+ACTION_DELETE = 'delete'
+
+# Верхняя граница срока правила политики, дней
+MAX_POLICY_DAYS = 3650
+
+# (bot_id, user_id, topic_id)
+TimerKey = Tuple[int, int, int]
+
+
+def is_valid_days(days: float) -> bool:
+    """Срок правила: конечное число дней от 0 до MAX_POLICY_DAYS"""
+    return math.isfinite(days) and 0 <= days <= MAX_POLICY_DAYS
+
+
+class RetryLater(Exception):
+    """Временная ошибка действия: таймер переставляется (через delay или с нарастающей задержкой)"""
+
+    def __init__(self, delay: Optional[float] = None):
+        super().__init__(delay)
+        self.delay = delay
+
+
+class TimerHeap:
+    """Мин-куча дедлайнов: один активный таймер на ключ, устаревшие записи отбрасываются при извлечении"""
+
+    def __init__(self):
+        self._heap: List[Tuple[float, TimerKey, str]] = []
+        self._deadlines: Dict[TimerKey, Tuple[float, str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def schedule(self, key: TimerKey, when: float, action: str):
+        """Поставить (или переставить) таймер ключа"""
+        # NaN в корне кучи остановил бы pop_due для всех таймеров
+        if not math.isfinite(when):
+            raise ValueError(f"Недопустимый дедлайн таймера {key}: {when}")
+        self._deadlines[key] = (when, action)
+        heapq.heappush(self._heap, (when, key, action))
+        self._maybe_compact()
+
+    def cancel(self, key: TimerKey):
+        """Отменить таймер; запись в куче удалится лениво"""
+        self._deadlines.pop(key, None)
+
+    def get(self, key: TimerKey) -> Optional[Tuple[float, str]]:
+        return self._deadlines.get(key)
+
+    def pop_due(self, now: float, limit: int) -> List[Tuple[TimerKey, str]]:
+        """Извлечь не более limit наступивших таймеров"""
+        due = []
+        while self._heap and len(due) < limit and self._heap[0][0] <= now:
+            when, key, action = heapq.heappop(self._heap)
+            if self._deadlines.get(key) != (when, action):
+                continue  # переставлен или отменен
+            del self._deadlines[key]
+            due.append((key, action))
+        return due
+
+    def items(self) -> List[Tuple[TimerKey, float, str]]:
+        return [(key, when, action) for key, (when, action) in self._deadlines.items()]
+
+    def _maybe_compact(self):
+        """Перестроение кучи, когда устаревших записей больше, чем живых"""
+        if len(self._heap) > 1024 and len(self._heap) > 2 * len(self._deadlines):
+            self._heap = [(when, key, action) for key, (when, action) in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+
+class LifecycleScheduler:
+    """Политики пользователей и таймеры закрытия/удаления их топиков"""
+
+    def __init__(self):
+        self.db: Optional[TopicDatabase] = None
+        self.timers = TimerHeap()
+        # (bot_id, user_id) -> {'close_days': N, 'delete_days': M}
+        self.policies: Dict[Tuple[int, int], Dict[str, float]] = {}
+        # Число повторов подряд для действий, отложенных из-за временных ошибок
+        self._attempts: Dict[TimerKey, int] = {}
+        # Ключи, изменившиеся после последней записи в базу
+        self._changed_timers: Set[TimerKey] = set()
+        self._changed_policies: Set[Tuple[int, int]] = set()
+
+    # ---------- политики ----------
+
+    def get_policy(self, bot_id: int, user_id: int) -> Dict[str, float]:
+        return self.policies.get((bot_id, user_id), {})
+
+    def set_policy(self, bot_id: int, user_id: int, **days: float):
+        """Изменить политику пользователя (0 - выключить правило)"""
+        for name, value in days.items():
+            if not is_valid_days(value):
+                raise ValueError(f"Недопустимый срок {name}: {value}")
+        policy = self.policies.setdefault((bot_id, user_id), {})
+        for name, value in days.items():
+            if value:
+                policy[name] = value
+            else:
+                policy.pop(name, None)
+        if not policy:
+            del self.policies[(bot_id, user_id)]
+        self._changed_policies.add((bot_id, user_id))
+
+    # ---------- события топиков ----------
+
+    def touch(self, bot_id: int, user_id: int, topic_id: int, now: Optional[float] = None):
+        """Активность в открытом топике: перенос автозакрытия"""
+        close_days = self.get_policy(bot_id, user_id).get('close_days')
+        key = (bot_id, user_id, topic_id)
+        if close_days:
+            self.timers.schedule(key, (now or time.time()) + close_days * DAY, ACTION_CLOSE)
+        else:
+            self.timers.cancel(key)
+        self._changed_timers.add(key)
+
+    def closed(self, bot_id: int, user_id: int, topic_id: int, now: Optional[float] = None):
+        """Топик закрыт: запуск таймера автоудаления"""
+        delete_days = self.get_policy(bot_id, user_id).get('delete_days')
+        key = (bot_id, user_id, topic_id)
+        if delete_days:
+            self.timers.schedule(key, (now or time.time()) + delete_days * DAY, ACTION_DELETE)
+        else:
+            self.timers.cancel(key)
+        self._changed_timers.add(key)
+
+    def forget(self, bot_id: int, user_id: int, topic_id: int):
+        """Топик удален: таймер больше не нужен"""
+        key = (bot_id, user_id, topic_id)
+        self.timers.cancel(key)
+        self._attempts.pop(key, None)
+        self._changed_timers.add(key)
+
+    # ---------- выполнение ----------
+
+    async def run(
+            self,
+            execute: Callable[[TimerKey, str], Awaitable[Any]],
+            tick: float = 30,
+            batch_size: int = 100,
+            rate: float = 20,
+            save_interval: float = 5,
+            retry_delay: float = 60,
+            max_retry_delay: float = 3600
+    ):
+        """
+        Цикл выполнения наступивших действий пачками не быстрее rate в секунду
+        Действие, завершившееся RetryLater, переставляется: через указанную задержку
+        или через retry_delay, удваивающуюся с каждым повтором (не больше max_retry_delay)
+        """
+        last_save = time.monotonic()
+
+        while True:
+            due = self.timers.pop_due(time.time(), batch_size)
+            if due:
+                self._changed_timers.update(key for key, _ in due)
+                logger.info(f"⏰ Жизненный цикл: действий к выполнению {len(due)}")
+
+            executed = 0
+            try:
+                for key, action in due:
+                    try:
+                        await execute(key, action)
+                        self._attempts.pop(key, None)
+                    except RetryLater as e:
+                        self._retry(key, action, e.delay, retry_delay, max_retry_delay)
+                        if e.delay:
+                            # Лимит Telegram (429) действует на все запросы бота - пауза для всей пачки
+                            await asyncio.sleep(e.delay)
+                    except Exception as e:
+                        self._attempts.pop(key, None)
+                        logger.error(f"Ошибка действия {action} для топика {key}: {e}")
+                    executed += 1
+                    await asyncio.sleep(1 / rate)
+            except asyncio.CancelledError:
+                # Остановка посреди пачки: невыполненные действия возвращаются в таймеры,
+                # иначе save() при остановке удалит их из базы
+                now = time.time()
+                for key, action in due[executed:]:
+                    if self.timers.get(key) is None:
+                        self.timers.schedule(key, now, action)
+                raise
+
+            if time.monotonic() - last_save >= save_interval:
+                await self.save()
+                last_save = time.monotonic()
+
+            if len(due) < batch_size:
+                await asyncio.sleep(tick)
+
+    def _retry(self, key: TimerKey, action: str, delay: Optional[float], retry_delay: float, max_retry_delay: float):
+        attempt = self._attempts.get(key, 0)
+        self._attempts[key] = attempt + 1
+        if delay is None:
+            delay = min(retry_delay * 2 ** attempt, max_retry_delay)
+
+        # Пока действие выполнялось, таймер могли переставить (сообщение в топике) - новый главнее
+        if self.timers.get(key) is None:
+            self.timers.schedule(key, time.time() + delay, action)
+            self._changed_timers.add(key)
+        logger.warning(f"Действие {action} для топика {key} отложено на {delay:.0f} с (повтор {attempt + 1})")
+
+    # ---------- сохранение ----------
+
+    def load(self, db: TopicDatabase, owns: Optional[Callable[[int], bool]] = None):
+        """
+        Загрузка политик и ожидающих дедлайнов из базы
+        owns - фильтр пользователей процесса (режим супервизора): чужие таймеры выполняет их процесс
+        """
+        self.db = db
+        policies, timers = db.load_lifecycle()
+
+        for bot_id, user_id, data in policies:
+            if owns is None or owns(user_id):
+                self.policies[(bot_id, user_id)] = json.loads(data)
+        for bot_id, user_id, topic_id, when, action in timers:
+            if owns is None or owns(user_id):
+                self.timers.schedule((bot_id, user_id, topic_id), when, action)
+
+        logger.info(f"📂 Жизненный цикл: политик {len(self.policies)}, таймеров {len(self.timers)}")
+
+    async def save(self):
+        """Запись изменившихся таймеров и политик в базу (в отдельном потоке)"""
+        if self.db is None or not (self._changed_timers or self._changed_policies):
+            return
+
+        changed_timers, self._changed_timers = self._changed_timers, set()
+        changed_policies, self._changed_policies = self._changed_policies, set()
+
+        timers = []
+        for key in changed_timers:
+            when, action = self.timers.get(key) or (None, None)
+            timers.append((*key, when, action))
+        policies = []
+        for key in changed_policies:
+            policy = self.policies.get(key)
+            policies.append((*key, json.dumps(policy) if policy else None))
+
+        try:
+            await asyncio.to_thread(self.db.write_lifecycle, policies, timers)
+        except sqlite3.Error as e:
+            # Ключи вернутся в очередь: значения читаются заново при следующей записи
+            logger.error(f"Ошибка сохранения жизненного цикла: {e}, повтор при следующей записи")
+            self._changed_timers |= changed_timers
+            self._changed_policies |= changed_policies
@@ -0,0 +1,54 @@
+"""
+Профиль выполнения бота: стандартный или быстрый (uvloop + orjson)
+Оба пакета опциональны - при их отсутствии используется стандартная библиотека
+"""
+
+import asyncio
+import json
+import logging
+from typing import Any, Callable, Coroutine, Dict
+
+logger = logging.getLogger(__name__)
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _orjson_dumps(obj: Any) -> str:
+    """orjson возвращает bytes, а aiogram ожидает строку для полей формы"""
+    return orjson.dumps(obj).decode()
+
+
+def get_json_codecs(fast: bool) -> Dict[str, Callable]:
+    """Функции json_loads/json_dumps для сессии бота"""
+    if fast and orjson is not None:
+        return {'json_loads': orjson.loads, 'json_dumps': _orjson_dumps}
+
+    if fast:
+        logger.warning("⚠️ orjson не установлен - используется стандартный json")
+    return {'json_loads': json.loads, 'json_dumps': json.dumps}
+
+
+def run(coro: Coroutine, fast: bool = False) -> Any:
+    """Запуск корутины в uvloop (если включен быстрый профиль) или в asyncio"""
+    if fast and uvloop is not None:
+        logger.info("⚡ Быстрый профиль: uvloop")
+        return uvloop.run(coro)
+
+    if fast:
+        logger.warning("⚠️ uvloop не установлен - используется стандартный asyncio")
+    return asyncio.run(coro)
+
+
+def describe(fast: bool) -> str:
+    """Краткое описание активного профиля для логов и бенчмарков"""
+    loop_name = "uvloop" if fast and uvloop is not None else "asyncio"
+    json_name = "orjson" if fast and orjson is not None else "json"
+    return f"{loop_name}+{json_name}"
@@ -0,0 +1,508 @@
+"""
+Хранилище топиков: SQLite (строка на топик) с горячим LRU-кэшем недавно активных пользователей
+Изменения копятся в буфере и пишутся в базу пачками в фоновом потоке
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TopicDatabase:
+    """Постоянное хранилище: пользователи ботов, их топики (по строке на топик), таймеры жизненного цикла и прогресс рассылки"""
+
+    def __init__(self, path: str = ":memory:", busy_timeout: float = 30):
+        self.path = path
+        self._read_conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False)
+        self._read_lock = threading.Lock()
+        if path == ":memory:":
+            # У базы в памяти нет второго соединения: чтение и запись через одно
+            self._write_conn, self._write_lock = self._read_conn, self._read_lock
+        else:
+            # Запись идет только из фонового потока; в режиме WAL чтение ее не ждет,
+            # а несколько процессов-обработчиков работают с одним файлом
+            self._write_conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False)
+            self._write_lock = threading.Lock()
+            self._write_conn.execute("PRAGMA journal_mode=WAL")
+            self._write_conn.execute("PRAGMA synchronous=NORMAL")
+
+        with self._write_lock, self._write_conn:
+            self._write_conn.executescript(
+                "CREATE TABLE IF NOT EXISTS users ("
+                " bot_id INTEGER NOT NULL,"
+                " user_id INTEGER NOT NULL,"
+                " blocked INTEGER NOT NULL DEFAULT 0,"
+                " PRIMARY KEY (bot_id, user_id));"
+                "CREATE TABLE IF NOT EXISTS topics ("
+                " bot_id INTEGER NOT NULL,"
+                " user_id INTEGER NOT NULL,"
+                " topic_id INTEGER NOT NULL,"
+                " data TEXT NOT NULL,"
+                " PRIMARY KEY (bot_id, user_id, topic_id));"
+                "CREATE TABLE IF NOT EXISTS lifecycle_policies ("
+                " bot_id INTEGER NOT NULL,"
+                " user_id INTEGER NOT NULL,"
+                " data TEXT NOT NULL,"
+                " PRIMARY KEY (bot_id, user_id));"
+                "CREATE TABLE IF NOT EXISTS lifecycle_timers ("
+                " bot_id INTEGER NOT NULL,"
+                " user_id INTEGER NOT NULL,"
+                " topic_id INTEGER NOT NULL,"
+                " deadline REAL NOT NULL,"
+                " action TEXT NOT NULL,"
+                " PRIMARY KEY (bot_id, user_id, topic_id));"
+                "CREATE TABLE IF NOT EXISTS service_state ("
+                " name TEXT PRIMARY KEY,"
+                " data TEXT NOT NULL);"
+            )
+
+    def _read(self, query: str, params: Tuple = ()) -> List[Tuple]:
+        with self._read_lock:
+            return self._read_conn.execute(query, params).fetchall()
+
+    def load_topics(self, bot_id: int, user_id: int) -> Optional[Dict[int, str]]:
+        """JSON топиков пользователя; None, если пользователь неизвестен"""
+        rows = self._read(
+            "SELECT topic_id, data FROM topics WHERE bot_id = ? AND user_id = ?", (bot_id, user_id)
+        )
+        if not rows and not self.exists(bot_id, user_id):
+            return None
+        return dict(rows)
+
+    def topics_after(self, bot_id: int, user_id: int, after: int, limit: int) -> List[Tuple[int, str]]:
+        """Страница топиков пользователя (topic_id, JSON) по возрастанию topic_id, начиная после after"""
+        return self._read(
+            "SELECT topic_id, data FROM topics WHERE bot_id = ? AND user_id = ? AND topic_id > ? "
+            "ORDER BY topic_id LIMIT ?",
+            (bot_id, user_id, after, limit)
+        )
+
+    def write_topics(
+            self,
+            bot_id: int,
+            users: Set[int],
+            upserts: List[Tuple[int, int, str]],
+            deletes: List[Tuple[int, int]],
+            active: Iterable[int] = ()
+    ):
+        """
+        Одна транзакция на пачку изменений (вызывается из фонового потока)
+        users - регистрация, active - пользователи, от которых были обновления:
+        и те и другие снова доступны для рассылки
+        """
+        users = users | self.blocked_among(bot_id, active)
+        if not (users or upserts or deletes):
+            return
+
+        with self._write_lock, self._write_conn:
+            self._write_conn.executemany(
+                "INSERT INTO users (bot_id, user_id) VALUES (?, ?) "
+                "ON CONFLICT (bot_id, user_id) DO UPDATE SET blocked = 0 WHERE blocked = 1",
+                [(bot_id, user_id) for user_id in users]
+            )
+            self._write_conn.executemany(
+                "INSERT INTO topics (bot_id, user_id, topic_id, data) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (bot_id, user_id, topic_id) DO UPDATE SET data = excluded.data",
+                [(bot_id, *row) for row in upserts]
+            )
+            self._write_conn.executemany(
+                "DELETE FROM topics WHERE bot_id = ? AND user_id = ? AND topic_id = ?",
+                [(bot_id, *row) for row in deletes]
+            )
+
+    def blocked_among(self, bot_id: int, user_ids: Iterable[int], batch_size: int = 500) -> Set[int]:
+        """Пользователи из user_ids, заблокировавшие бота"""
+        user_ids = list(user_ids)
+        blocked: Set[int] = set()
+        for i in range(0, len(user_ids), batch_size):
+            batch = user_ids[i:i + batch_size]
+            rows = self._read(
+                f"SELECT user_id FROM users WHERE bot_id = ? AND blocked = 1 "
+                f"AND user_id IN ({', '.join('?' * len(batch))})",
+                (bot_id, *batch)
+            )
+            blocked.update(user_id for user_id, in rows)
+        return blocked
+
+    def set_blocked(self, bot_id: int, user_ids: Iterable[int]):
+        """Отметка о блокировке бота (снимается при следующем обновлении от пользователя)"""
+        with self._write_lock, self._write_conn:
+            self._write_conn.executemany(
+                "UPDATE users SET blocked = 1 WHERE bot_id = ? AND user_id = ?",
+                [(bot_id, user_id) for user_id in user_ids]
+            )
+
+    def load_lifecycle(self) -> Tuple[List[Tuple[int, int, str]], List[Tuple[int, int, int, float, str]]]:
+        """Все политики (JSON) и таймеры жизненного цикла"""
+        return (
+            self._read("SELECT bot_id, user_id, data FROM lifecycle_policies"),
+            self._read("SELECT bot_id, user_id, topic_id, deadline, action FROM lifecycle_timers"),
+        )
+
+    def write_lifecycle(
+            self,
+            policies: List[Tuple[int, int, Optional[str]]],
+            timers: List[Tuple[int, int, int, Optional[float], Optional[str]]]
+    ):
+        """Изменившиеся политики и таймеры; None - запись удалена"""
+        with self._write_lock, self._write_conn:
+            self._write_conn.executemany(
+                "INSERT INTO lifecycle_policies (bot_id, user_id, data) VALUES (?, ?, ?) "
+                "ON CONFLICT (bot_id, user_id) DO UPDATE SET data = excluded.data",
+                [row for row in policies if row[2] is not None]
+            )
+            self._write_conn.executemany(
+                "DELETE FROM lifecycle_policies WHERE bot_id = ? AND user_id = ?",
+                [row[:2] for row in policies if row[2] is None]
+            )
+            self._write_conn.executemany(
+                "INSERT INTO lifecycle_timers (bot_id, user_id, topic_id, deadline, action) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (bot_id, user_id, topic_id) DO UPDATE SET "
+                "deadline = excluded.deadline, action = excluded.action",
+                [row for row in timers if row[3] is not None]
+            )
+            self._write_conn.executemany(
+                "DELETE FROM lifecycle_timers WHERE bot_id = ? AND user_id = ? AND topic_id = ?",
+                [row[:3] for row in timers if row[3] is None]
+            )
+
+    # Состояние фоновых служб (JSON), общее для всех процессов-обработчиков
+
+    def load_state(self, name: str) -> Optional[str]:
+        rows = self._read("SELECT data FROM service_state WHERE name = ?", (name,))
+        return rows[0][0] if rows else None
+
+    def insert_state(self, name: str, data: str) -> bool:
+        """False, если состояние уже есть (служба занята другим процессом)"""
+        with self._write_lock, self._write_conn:
+            return self._write_conn.execute(
+                "INSERT OR IGNORE INTO service_state (name, data) VALUES (?, ?)", (name, data)
+            ).rowcount > 0
+
+    def update_state(self, name: str, data: str) -> bool:
+        """False, если состояние удалено (например, командой из другого процесса)"""
+        with self._write_lock, self._write_conn:
+            return self._write_conn.execute(
+                "UPDATE service_state SET data = ? WHERE name = ?", (data, name)
+            ).rowcount > 0
+
+    def delete_state(self, name: str) -> bool:
+        with self._write_lock, self._write_conn:
+            return self._write_conn.execute(
+                "DELETE FROM service_state WHERE name = ?", (name,)
+            ).rowcount > 0
+
+    def exists(self, bot_id: int, user_id: int) -> bool:
+        return bool(self._read(
+            "SELECT 1 FROM users WHERE bot_id = ? AND user_id = ?", (bot_id, user_id)
+        ))
+
+    def count(self, bot_id: int) -> int:
+        return self._read("SELECT COUNT(*) FROM users WHERE bot_id = ?", (bot_id,))[0][0]
+
+    def user_ids_after(self, bot_id: int, after: int, limit: int) -> List[int]:
+        """Страница ID пользователей по возрастанию, начиная после after (поиск по первичному ключу)"""
+        rows = self._read(
+            "SELECT user_id FROM users WHERE bot_id = ? AND user_id > ? ORDER BY user_id LIMIT ?",
+            (bot_id, after, limit)
+        )
+        return [user_id for user_id, in rows]
+
+    def iter_user_ids(self, bot_id: int, page_size: int = 1000) -> Iterator[int]:
+        """ID пользователей по возрастанию, постранично (без открытого курсора между страницами)"""
+        after = 0
+        while True:
+            page = self.user_ids_after(bot_id, after, page_size)
+            if not page:
+                return
+            after = page[-1]
+            yield from page
+
+    def close(self):
+        with self._write_lock:
+            self._write_conn.close()
+        if self._read_conn is not self._write_conn:
+            with self._read_lock:
+                self._read_conn.close()
+
+
+class HotCache:
+    """LRU-кэш карт топиков недавно активных пользователей, ограниченный числом записей и байтами"""
+
+    def __init__(self, max_entries: int = 10_000, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # (bot_id, user_id) -> [карта топиков, размер ее JSON в байтах - оценка веса записи,
+        #                      размеры JSON отдельных топиков]
+        self._entries: "OrderedDict[Tuple[int, int], List[Any]]" = OrderedDict()
+        self._bytes = 0
+        self.counters: Dict[str, int] = {'hits': 0, 'misses': 0, 'evictions': 0, 'loads': 0, 'writes': 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Tuple[int, int]) -> Optional[Dict[int, Dict[str, Any]]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.counters['misses'] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.counters['hits'] += 1
+        return entry[0]
+
+    def peek(self, key: Tuple[int, int]) -> Optional[Dict[int, Dict[str, Any]]]:
+        """Чтение без учета в LRU и метриках"""
+        entry = self._entries.get(key)
+        return entry[0] if entry else None
+
+    def put(self, key: Tuple[int, int], topics: Dict[int, Dict[str, Any]], sizes: Dict[int, int]):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous[1]
+        size = sum(sizes.values())
+        self._entries[key] = [topics, size, sizes]
+        self._bytes += size
+        self._evict()
+
+    def set_topic_size(self, key: Tuple[int, int], topic_id: int, size: Optional[int]):
+        """Новый размер JSON топика после сохранения; None - топик удален"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        sizes = entry[2]
+        delta = (size or 0) - sizes.pop(topic_id, 0)
+        if size is not None:
+            sizes[topic_id] = size
+        entry[1] += delta
+        self._bytes += delta
+        self._evict()
+
+    def _evict(self):
+        # Несохраненные изменения лежат в буфере TopicStore, поэтому вытеснение ничего не теряет
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.counters['evictions'] += 1
+
+    def drop_bot(self, bot_id: int):
+        for key in [key for key in self._entries if key[0] == bot_id]:
+            self._bytes -= self._entries.pop(key)[1]
+
+    def bytes_by_bot(self) -> Dict[int, int]:
+        sizes: Dict[int, int] = {}
+        for (bot_id, _), (_, size, _) in self._entries.items():
+            sizes[bot_id] = sizes.get(bot_id, 0) + size
+        return sizes
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.counters['hits'] + self.counters['misses']
+        return {
+            **self.counters,
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'hit_rate': self.counters['hits'] / lookups if lookups else 0.0,
+        }
+
+
+class WriteBatch:
+    """Изменения, еще не записанные в базу"""
+    __slots__ = ('topics', 'users', 'active')
+
+    def __init__(self):
+        # user_id -> {topic_id: JSON топика или None, если топик удален}
+        self.topics: Dict[int, Dict[int, Optional[str]]] = {}
+        # Зарегистрированные пользователи (в том числе без топиков)
+        self.users: Set[int] = set()
+        # Пользователи, от которых были обновления
+        self.active: Set[int] = set()
+
+    def __bool__(self) -> bool:
+        return bool(self.topics or self.users or self.active)
+
+    def update(self, newer: "WriteBatch"):
+        """Наложение более поздних изменений"""
+        for user_id, changes in newer.topics.items():
+            self.topics.setdefault(user_id, {}).update(changes)
+        self.users |= newer.users
+        self.active |= newer.active
+
+
+class TopicStore:
+    """
+    Хранилище топиков одного бота: user_id -> {topic_id: info}
+    Чтение через горячий кэш с загрузкой из базы при промахе. Изменения (save_topic, delete_topic)
+    сразу видны в кэше, а в базу пишутся пачками (flush) в фоновом потоке, не блокируя цикл событий
+    """
+
+    def __init__(self, bot_id: int, db: TopicDatabase, cache: HotCache):
+        self.bot_id = bot_id
+        self.db = db
+        self.cache = cache
+        self._pending = WriteBatch()
+        # Пачка, которая пишется в базу прямо сейчас
+        self._inflight: Optional[WriteBatch] = None
+
+    def _load(self, user_id: int) -> Optional[Tuple[Dict[int, Dict[str, Any]], Dict[int, int]]]:
+        """Карта топиков из базы с наложением еще не записанных изменений; None, если пользователь неизвестен"""
+        rows = self.db.load_topics(self.bot_id, user_id)
+        known = rows is not None
+        rows = rows or {}
+
+        for batch in (self._inflight, self._pending):
+            if batch is None:
+                continue
+            known = known or user_id in batch.users
+            for topic_id, data in batch.topics.get(user_id, {}).items():
+                if data is None:
+                    rows.pop(topic_id, None)
+                else:
+                    rows[topic_id] = data
+        if not known:
+            return None
+
+        topics = {topic_id: json.loads(data) for topic_id, data in rows.items()}
+        return topics, {topic_id: len(data) for topic_id, data in rows.items()}
+
+    def get(self, user_id: int, default: Any = None) -> Any:
+        key = (self.bot_id, user_id)
+        topics = self.cache.get(key)
+        if topics is not None:
+            return topics
+
+        loaded = self._load(user_id)
+        if loaded is None:
+            return default
+
+        topics, sizes = loaded
+        self.cache.put(key, topics, sizes)
+        self.cache.counters['loads'] += 1
+        return topics
+
+    def peek(self, user_id: int, default: Any = None) -> Any:
+        """Чтение для фоновых проходов по всем пользователям: не вытесняет горячих из кэша"""
+        topics = self.cache.peek((self.bot_id, user_id))
+        if topics is not None:
+            return topics
+
+        loaded = self._load(user_id)
+        return default if loaded is None else loaded[0]
+
+    async def iter_topics(self, user_id: int, page_size: int = 1000) -> AsyncIterator[List[Tuple[int, Dict[str, Any]]]]:
+        """
+        Топики пользователя страницами по topic_id для потоковых проходов (выгрузка):
+        страницы читаются из базы в фоновом потоке с наложением незаписанных изменений, кэш не затрагивается
+        """
+        after = 0
+        while True:
+            rows = await asyncio.to_thread(self.db.topics_after, self.bot_id, user_id, after, page_size)
+            # Последняя страница забирает и еще не записанные топики с большими ID
+            upper = rows[-1][0] if len(rows) == page_size else None
+            page = dict(rows)
+            for batch in (self._inflight, self._pending):
+                if batch is None:
+                    continue
+                for topic_id, data in batch.topics.get(user_id, {}).items():
+                    if topic_id <= after or (upper is not None and topic_id > upper):
+                        continue
+                    if data is None:
+                        page.pop(topic_id, None)
+                    else:
+                        page[topic_id] = data
+
+            if page:
+                yield [(topic_id, json.loads(page[topic_id])) for topic_id in sorted(page)]
+            if upper is None:
+                return
+            after = upper
+
+    def save_topic(self, user_id: int, topic_id: int, info: Dict[str, Any]):
+        """Сохранение одного топика: в кэше сразу, в базе - со следующей пачкой"""
+        data = json.dumps(info)
+        self._pending.users.add(user_id)
+        self._pending.topics.setdefault(user_id, {})[topic_id] = data
+
+        key = (self.bot_id, user_id)
+        topics = self.cache.peek(key)
+        if topics is None:
+            # Вытеснен или новый: карта собирается из базы и буфера, где уже есть этот топик
+            topics = self.get(user_id, {})
+        # Обработчики меняют info на месте, поэтому прежний размер берется из кэша, а не из info
+        self.cache.set_topic_size(key, topic_id, len(data))
+        topics[topic_id] = info
+        self.cache.counters['writes'] += 1
+
+    def delete_topic(self, user_id: int, topic_id: int) -> Optional[Dict[str, Any]]:
+        """Удаление топика; возвращает его данные, если он был"""
+        topics = self.get(user_id, {})
+        info = topics.pop(topic_id, None)
+        if info is not None:
+            self._pending.topics.setdefault(user_id, {})[topic_id] = None
+            self.cache.set_topic_size((self.bot_id, user_id), topic_id, None)
+            self.cache.counters['writes'] += 1
+        return info
+
+    def prefetch(self, user_id: int) -> Dict[int, Dict[str, Any]]:
+        """Прогрев кэша (при /start); новый пользователь регистрируется со следующей пачкой"""
+        self._pending.users.add(user_id)
+        return self.get(user_id, {})
+
+    def mark_active(self, user_id: int):
+        """Обновление от пользователя: отметка о блокировке бота снимается со следующей пачкой"""
+        self._pending.active.add(user_id)
+
+    async def user_ids_after(self, after: int, limit: int) -> List[int]:
+        return await asyncio.to_thread(self.db.user_ids_after, self.bot_id, after, limit)
+
+    async def count(self) -> int:
+        return await asyncio.to_thread(self.db.count, self.bot_id)
+
+    async def blocked_users(self, user_ids: Iterable[int]) -> Set[int]:
+        return await asyncio.to_thread(self.db.blocked_among, self.bot_id, user_ids)
+
+    async def mark_blocked(self, user_ids: Iterable[int]):
+        await asyncio.to_thread(self.db.set_blocked, self.bot_id, user_ids)
+
+    async def flush(self):
+        """Запись накопленных изменений одной транзакцией в фоновом потоке"""
+        if self._inflight is not None or not self._pending:
+            return
+
+        batch = self._inflight = self._pending
+        self._pending = WriteBatch()
+        upserts, deletes = [], []
+        for user_id, changes in batch.topics.items():
+            for topic_id, data in changes.items():
+                if data is None:
+                    deletes.append((user_id, topic_id))
+                else:
+                    upserts.append((user_id, topic_id, data))
+
+        try:
+            await asyncio.to_thread(self.db.write_topics, self.bot_id, batch.users, upserts, deletes, batch.active)
+        except sqlite3.Error as e:
+            # Например, база занята другим процессом дольше busy timeout:
+            # изменения возвращаются в буфер и уйдут со следующей пачкой
+            logger.error(f"Ошибка записи топиков бота {self.bot_id}: {e}, повтор со следующей пачкой")
+            batch.update(self._pending)
+            self._pending = batch
+        finally:
+            self._inflight = None
+
+    def __contains__(self, user_id: int) -> bool:
+        return (
+            self.cache.get((self.bot_id, user_id)) is not None
+            or user_id in self._pending.users
+            or self.db.exists(self.bot_id, user_id)
+        )
+
+    def __len__(self) -> int:
+        return self.db.count(self.bot_id)
+
+    def __iter__(self) -> Iterator[int]:
+        return self.db.iter_user_ids(self.bot_id)
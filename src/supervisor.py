@@ -0,0 +1,244 @@
+"""
+Режим супервизора: один процесс читает обновления, пул процессов их обрабатывает
+Обновления распределяются по user_id через консистентное хеширование,
+поэтому состояние и порядок сообщений пользователя остаются в одном процессе
+"""
+
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import queue as queue_module
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+
+logger = logging.getLogger(__name__)
+
+# Сигнал остановки процесса-обработчика
+STOP = None
+
+
+class HashRing:
+    """Кольцо консистентного хеширования с виртуальными узлами"""
+
+    def __init__(self, nodes: int, replicas: int = 64):
+        ring = sorted(
+            (self._hash(f"worker-{node}#{replica}"), node)
+            for node in range(nodes)
+            for replica in range(replicas)
+        )
+        self._hashes = [h for h, _ in ring]
+        self._nodes = [node for _, node in ring]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+    def get_node(self, key: int) -> int:
+        index = bisect.bisect(self._hashes, self._hash(str(key))) % len(self._hashes)
+        return self._nodes[index]
+
+
+def extract_user_id(update: Dict[str, Any]) -> int:
+    """ID пользователя (или чата) из сырого обновления; update_id, если его нет"""
+    for name, event in update.items():
+        if name == 'update_id' or not isinstance(event, dict):
+            continue
+        for field in ('from', 'user', 'chat'):
+            owner = event.get(field)
+            if isinstance(owner, dict) and 'id' in owner:
+                return owner['id']
+    return update['update_id']
+
+
+async def consume_updates(dp: Dispatcher, bots: List[Bot], updates: multiprocessing.Queue, handled,
+                          max_in_flight: int = 1000):
+    """
+    Цикл процесса-обработчика: обновления разных пользователей обрабатываются
+    параллельно, одного пользователя - строго по очереди
+    Не больше max_in_flight обновлений в работе: остальные ждут в очереди, и когда она
+    заполнена, супервизор перестает читать getUpdates
+    """
+    loop = asyncio.get_running_loop()
+    chains: Dict[int, asyncio.Task] = {}
+    slots = asyncio.Semaphore(max_in_flight)
+
+    async def process(previous: Optional[asyncio.Task], bot: Bot, update: Dict[str, Any]):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception as e:
+            logger.error(f"Ошибка обработки обновления {update.get('update_id')}: {e}")
+        finally:
+            slots.release()
+        handled.value += 1
+
+    def release(user_id: int, task: asyncio.Task):
+        # Цепочка пользователя завершена, если за ней не встало новое обновление
+        if chains.get(user_id) is task:
+            del chains[user_id]
+
+    while True:
+        # Место занимается до чтения: при сбое процесса теряется не больше max_in_flight обновлений
+        await slots.acquire()
+        item = await loop.run_in_executor(None, updates.get)
+        if item is STOP:
+            break
+
+        bot_index, user_id, update = item
+        task = asyncio.create_task(process(chains.get(user_id), bots[bot_index], update))
+        chains[user_id] = task
+        task.add_done_callback(lambda t, uid=user_id: release(uid, t))
+
+    if chains:
+        await asyncio.wait(list(chains.values()))
+
+
+class Supervisor:
+    """Чтение getUpdates всех ботов, раздача обновлений процессам и их перезапуск при падении"""
+
+    def __init__(
+            self,
+            bots: List[Bot],
+            workers: int,
+            target: Callable,
+            allowed_updates: List[str],
+            report_interval: float = 60,
+            polling_timeout: int = 30
+    ):
+        self.bots = bots
+        self.workers = workers
+        self.target = target
+        self.allowed_updates = allowed_updates
+        self.report_interval = report_interval
+        self.polling_timeout = polling_timeout
+
+        self.ring = HashRing(workers)
+        self._ctx = multiprocessing.get_context('spawn')
+        self._queues = [self._ctx.Queue(maxsize=10_000) for _ in range(workers)]
+        self._handled = [self._ctx.Value('Q', 0, lock=False) for _ in range(workers)]
+        self._dispatched = [0] * workers
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * workers
+        self._restarts = [0] * workers
+        self._crash_streak = [0] * workers
+        self._started_at = [0.0] * workers
+
+    async def run(self):
+        for index in range(self.workers):
+            self._start_worker(index)
+        logger.info(f"🧩 Супервизор: процессов-обработчиков {self.workers}")
+
+        tasks = [asyncio.create_task(self._poll(index, bot)) for index, bot in enumerate(self.bots)]
+        tasks.append(asyncio.create_task(self._watch()))
+        tasks.append(asyncio.create_task(self._report()))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.to_thread(self._shutdown)
+
+    def _start_worker(self, index: int):
+        process = self._ctx.Process(
+            target=self.target,
+            args=(index, self._queues[index], self._handled[index]),
+            name=f"bot-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+
+    async def _poll(self, bot_index: int, bot: Bot):
+        """Long polling одного бота без разбора обновлений в модели - только маршрутизация"""
+        session = await bot.session.create_session()
+        url = bot.session.api.api_url(token=bot.token, method='getUpdates')
+        offset = None
+        backoff = 1
+
+        while True:
+            try:
+                payload = {'timeout': self.polling_timeout, 'allowed_updates': self.allowed_updates}
+                if offset is not None:
+                    payload['offset'] = offset
+                async with session.post(url, json=payload, timeout=self.polling_timeout + 10) as resp:
+                    data = await resp.json(loads=bot.session.json_loads)
+                if not data.get('ok'):
+                    raise RuntimeError(data.get('description'))
+                backoff = 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка getUpdates бота {bot.id}: {e}, повтор через {backoff} с")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+
+            for update in data['result']:
+                offset = update['update_id'] + 1
+                user_id = extract_user_id(update)
+                worker = self.ring.get_node(user_id)
+                await self._put(worker, (bot_index, user_id, update))
+                self._dispatched[worker] += 1
+
+    async def _put(self, worker: int, item: Any):
+        """Передача в очередь процесса; при переполнении ждем, не блокируя цикл событий"""
+        while True:
+            try:
+                self._queues[worker].put_nowait(item)
+                return
+            except queue_module.Full:
+                await asyncio.sleep(0.05)
+
+    async def _watch(self):
+        """Перезапуск упавших процессов (очередь сохраняется, маршрутизация не меняется)"""
+        while True:
+            await asyncio.sleep(1)
+            for index, process in enumerate(self._processes):
+                if process is None or process.is_alive():
+                    continue
+                self._restarts[index] += 1
+                # Задержка растет только при частых падениях подряд
+                if time.monotonic() - self._started_at[index] > 60:
+                    self._crash_streak[index] = 0
+                delay = min(2 ** self._crash_streak[index], 30)
+                self._crash_streak[index] += 1
+                logger.error(
+                    f"💥 Процесс {process.name} завершился с кодом {process.exitcode}, "
+                    f"перезапуск #{self._restarts[index]} через {delay} с"
+                )
+                self._processes[index] = None
+                asyncio.get_running_loop().call_later(delay, self._start_worker, index)
+
+    async def _report(self):
+        """Пропускная способность по процессам"""
+        previous = [0] * self.workers
+        started = time.monotonic()
+        while True:
+            await asyncio.sleep(self.report_interval)
+            elapsed = time.monotonic() - started
+            started = time.monotonic()
+            lines = []
+            for index in range(self.workers):
+                handled = self._handled[index].value
+                lines.append(
+                    f"   #{index}: {(handled - previous[index]) / elapsed:.1f} обн./с, "
+                    f"обработано {handled}, отправлено {self._dispatched[index]}, "
+                    f"перезапусков {self._restarts[index]}"
+                )
+                previous[index] = handled
+            logger.info("🧩 Процессы-обработчики:\n" + "\n".join(lines))
+
+    def _shutdown(self):
+        for index, process in enumerate(self._processes):
+            if process is not None and process.is_alive():
+                self._queues[index].put(STOP)
+        for process in self._processes:
+            if process is not None:
+                process.join(timeout=10)
+                if process.is_alive():
+                    process.terminate()
@@ -0,0 +1,184 @@
+"""
+Защита от флуда: ограничение частоты действий пользователя
+Скользящие окна на пользователя и действие, LRU-хранилище с вытеснением неактивных
+"""
+
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+logger = logging.getLogger(__name__)
+
+# Действие, под которым считаются все обновления пользователя
+ANY_ACTION = '*'
+
+
+class SlidingWindow:
+    """Приближенное скользящее окно: текущий и предыдущий интервалы, O(1) памяти"""
+    __slots__ = ('start', 'prev', 'curr')
+
+    def __init__(self, now: float):
+        self.start = now
+        self.prev = 0
+        self.curr = 0
+
+    def allows(self, now: float, limit: int, window: float) -> bool:
+        """Есть ли место для события (само событие не учитывается)"""
+        passed = int((now - self.start) // window)
+        if passed:
+            self.prev = self.curr if passed == 1 else 0
+            self.curr = 0
+            self.start += passed * window
+
+        weight = 1 - (now - self.start) / window
+        return self.prev * weight + self.curr < limit
+
+    def hit(self, now: float, limit: int, window: float) -> bool:
+        """Учесть событие; False, если лимит исчерпан"""
+        if not self.allows(now, limit, window):
+            return False
+        self.curr += 1
+        return True
+
+
+class UserState:
+    """Счетчики одного пользователя"""
+    __slots__ = ('last_seen', 'windows', 'last_callback', 'warned_at')
+
+    def __init__(self, now: float):
+        self.last_seen = now
+        self.windows: Dict[str, SlidingWindow] = {}
+        self.last_callback: Optional[Tuple[str, float]] = None
+        self.warned_at = 0.0
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware для message и callback_query: отбрасывает обновления сверх лимитов
+    limits - действие -> (событий, окно в секундах); общий лимит пользователя под ключом ANY_ACTION
+    actions - префикс callback_data или команды -> действие
+    """
+
+    def __init__(
+            self,
+            limits: Dict[str, Tuple[int, float]],
+            actions: Dict[str, str],
+            max_users: int = 100_000,
+            idle_ttl: float = 600,
+            coalesce_window: float = 1.0
+    ):
+        self.limits = limits
+        self.actions = actions
+        self.max_users = max_users
+        self.idle_ttl = idle_ttl
+        self.coalesce_window = coalesce_window
+
+        # (bot_id, user_id) -> счетчики: у каждого бота процесса свои лимиты
+        self._users: "OrderedDict[Tuple[int, int], UserState]" = OrderedDict()
+        self.counters: Dict[str, int] = {'allowed': 0, 'coalesced': 0, 'evicted': 0}
+        self.dropped: Dict[str, int] = {}
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        user = getattr(event, 'from_user', None)
+        if user is None:
+            return await handler(event, data)
+
+        now = time.monotonic()
+        state = self._get_state((data['bot'].id, user.id), now)
+
+        if isinstance(event, CallbackQuery) and self._is_double_click(state, event, now):
+            self.counters['coalesced'] += 1
+            await event.answer()
+            return None
+
+        action = self._resolve_action(event)
+        checked = []
+        for key in (ANY_ACTION, action):
+            if key not in self.limits:
+                continue
+            limit, window = self.limits[key]
+            counter = state.windows.get(key)
+            if counter is None:
+                counter = state.windows[key] = SlidingWindow(now)
+            if not counter.allows(now, limit, window):
+                self.dropped[key] = self.dropped.get(key, 0) + 1
+                logger.debug(f"Флуд: пользователь {user.id}, действие {key} - обновление отброшено")
+                await self._reject(event, state, now, window)
+                return None
+            checked.append((counter, limit, window))
+
+        # Отброшенное обновление не расходует ни один лимит, поэтому учет - только после всех проверок
+        for counter, limit, window in checked:
+            counter.hit(now, limit, window)
+
+        self.counters['allowed'] += 1
+        return await handler(event, data)
+
+    def _get_state(self, key: Tuple[int, int], now: float) -> UserState:
+        """Состояние пользователя бота с обновлением LRU и вытеснением неактивных"""
+        state = self._users.get(key)
+        if state is None:
+            state = self._users[key] = UserState(now)
+        else:
+            self._users.move_to_end(key)
+        state.last_seen = now
+
+        # Начало словаря - самые давно активные пользователи
+        while self._users:
+            oldest_key, oldest = next(iter(self._users.items()))
+            if len(self._users) <= self.max_users and now - oldest.last_seen < self.idle_ttl:
+                break
+            del self._users[oldest_key]
+            self.counters['evicted'] += 1
+        return state
+
+    def _is_double_click(self, state: UserState, callback: CallbackQuery, now: float) -> bool:
+        """Повторное нажатие той же кнопки за coalesce_window"""
+        message_id = callback.message.message_id if callback.message else 0
+        key = f"{message_id}:{callback.data}"
+        previous = state.last_callback
+        state.last_callback = (key, now)
+        return previous is not None and previous[0] == key and now - previous[1] < self.coalesce_window
+
+    def _resolve_action(self, event: TelegramObject) -> Optional[str]:
+        """Ограничиваемое действие по callback_data или команде"""
+        if isinstance(event, CallbackQuery):
+            value = event.data or ''
+        elif isinstance(event, Message):
+            parts = (event.text or '').split(maxsplit=1)
+            value = parts[0] if parts else ''
+        else:
+            return None
+
+        for prefix, action in self.actions.items():
+            if value.startswith(prefix):
+                return action
+        return None
+
+    @staticmethod
+    async def _reject(event: TelegramObject, state: UserState, now: float, window: float):
+        """Сообщения отбрасываются молча, на нажатия кнопок - короткий ответ (не чаще раза за окно)"""
+        if not isinstance(event, CallbackQuery):
+            return
+        if now - state.warned_at >= window:
+            state.warned_at = now
+            await event.answer("⏳ Слишком часто, подождите немного")
+        else:
+            await event.answer()
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики для настройки лимитов"""
+        return {
+            **self.counters,
+            'dropped': dict(self.dropped),
+            'tracked_users': len(self._users),
+        }